@@ -1,47 +1,74 @@
 #!/usr/bin/env python2
+"""
+Postanalysis of the austronesian.log file generated by BEAST when the
+Austronesian analysis is run.  This will compute the ranking of meaning
+classes by posterior mean mutation rate.
+
+Each step is a stage which can be run on its own, e.g. "python
+postprocess.py means tables".  The means are computed once and shared by
+the later stages, which read them back from parameter_means.csv only if
+they are run without the means stage.
+"""
 import csv
 import sys
 
-import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
-
 sys.path.append("..")
+import inputs
+import results
+import stages
 import utils
 
-def main():
+def analysis_results(args):
     """
-    Postanalysis of the austronesian.log file generated by BEAST when the
-    Austronesian analysis is run.  This will compute the ranking of meaning
-    classes by posterior mean mutation rate.
+    Return the AnalysisResults computed by the means stage, if it was run,
+    or else read them from parameter_means.csv, with the features named.
     """
+    if getattr(args, "results", None) is None:
+        args.results = results.load("parameter_means.csv")
+        args.results.set_names(load_wals_feature_names().get)
+    return args.results
+
+def means(args):
+    args.results = results.from_log("austronesian.log", cache=True)
+    args.results.set_names(load_wals_feature_names().get)
+    args.results.export("parameter_means.csv")
+    args.results.export_intervals("parameter_intervals.csv")
+
+def ranks(args):
+    utils.write_rank_uncertainty("austronesian.log", "rank_uncertainty.csv",
+            cache=True)
 
-    print("Computing posterior mean paramter estimates...")
-    ranked_means = utils.write_means("austronesian.log", "parameter_means.csv")
-    print("Generating LaTeX tables...")
-    make_tables(ranked_means)
-    print("Generating rate variation figure...")
-    make_figure("rate_variation.eps")
+def tables(args):
+    make_tables(analysis_results(args))
+
+def figures(args):
+    make_figure(analysis_results(args), "rate_variation.eps")
+
+STAGES = [
+    ("means", means, "Computing posterior mean paramter estimates"),
+    ("ranks", ranks, "Computing posterior rank distributions"),
+    ("tables", tables, "Generating LaTeX tables"),
+    ("figures", figures, "Generating rate variation figure"),
+]
 
 def load_wals_feature_names():
     """
-    Build a dictionary mapping WALS feature IDs to feature names.
+    Build a dictionary mapping WALS feature IDs to feature names, from the
+    header of language.csv alone.
     """
-    fp = open("language.csv","r")
-    reader = csv.DictReader(fp)
-    fn = reader.fieldnames
+    fp = inputs.open_input("language.csv", "r")
+    fn = next(csv.reader(fp))
+    fp.close()
     features = [f for f in fn if f[0].isdigit()]
     features = [f.split(" ",1) for f in features]
     return dict(features)
 
-def make_tables(ranked_means):
+def make_tables(analysis):
     """
     Generate a LaTeX table of fastest and slowest WALS features and save it
     in the file table.tex for inclusion in the manuscript.
     """
-    nice = load_wals_feature_names()
-    nice_ranked_means = [(r, \
-            nice[n.split(":")[-1]]) for (r,n) in ranked_means]
+    nice_ranked_means = list(zip(analysis.means, analysis.names))
     top_10 = nice_ranked_means[0:10]
     bottom_10 = nice_ranked_means[-10:]
 
@@ -63,33 +90,26 @@ def make_tables(ranked_means):
     fp.write("""\\begin{tabular}{|c|p{0.75\linewidth}|}
 	\\hline
 	WALS feature ID & WALS feature Name  \\\\ \hline \n""")
-    f_ids = [f_id.split(":")[-1] for (rate, f_id) in ranked_means]
-    f_ids.sort(key = lambda x: int(x[:-1]))
-    for f_id in f_ids:
-        name = nice[f_id]
+    f_ids = sorted(zip(analysis.ids, analysis.names),
+            key = lambda x: int(x[0][:-1]))
+    for f_id, name in f_ids:
         fp.write("%s & %s \\\\\n" % (f_id, name))
     fp.write("\\hline\n""")
     fp.write("\\end{tabular}\n")
     
-def make_figure(filename):
+def make_figure(analysis, filename):
     """
     Generate an image file for Figure 4 in the paper, showing the distribution
     of relative rates amongst WALS features.
     """
-    # Read mean feature rates
-    fp = open("parameter_means.csv", "r")
-    mean_rates = {}
-    for line in fp:
-        feature, rate = line.strip().split(",")
-        feature = feature.split(":")[-1]
-        mean_rates[feature] = float(rate)
-    fp.close()
+    import matplotlib.pyplot as plt
+    import seaborn as sns
 
     fig = plt.figure()
     sns.set(style="whitegrid", palette="muted")
     sns.set_context("paper",font_scale=1.25)
     bins = (0,0.25,0.75,1.25,1.75,2.25,2.75,3)
-    ax = sns.distplot(mean_rates.values(),bins=bins,
+    ax = sns.distplot(analysis.means,bins=bins,
             hist_kws={"color":"#b5c9eb","linewidth":0})
     ax.set_xlim(0, 3)
     ax.set_ylim(0, 1)
@@ -102,4 +122,5 @@ def make_figure(filename):
     plt.savefig(filename, dpi=600)
 
 if __name__ == "__main__":
-    main()
+    stages.main(STAGES, stages.parser(STAGES,
+        __doc__.split("\n\n")[0].strip()), __file__, ["austronesian.log"])
@@ -3,17 +3,23 @@ import csv
 import subprocess
 import sys
 
-import newick
-
 sys.path.append("..")
+import inputs
+import linking
+import matrix
+import trees
 import utils
 
+# These WALS features combine the values of other features
+EXCLUDED_FEATURES = ("95A", "96A", "97A")
+
 def main():
     """
     Prepare the MCC tree and WALS data for the Austronesian analysis.  This
     involves establishing a duplicate-free mapping from language names to ISO
     codes and pruning the tree accordingly.  The WALS data has to be
-    reformatted into CLDF format as well,
+    reformatted into CLDF format as well, and is then encoded as a binary
+    matrix of the languages and features the analysis will use.
     """
     print("Resolving ISO codes...")
     a_exclusions, a_mapping, w_exclusions = resolve_languages()
@@ -22,59 +28,22 @@ def main():
     print("Preparing reference tree...")
     clean_reference_tree()
     adjust_reference_tree(a_exclusions, a_mapping)
+    print("Encoding data matrix...")
+    matrix.encode_config("austronesian.conf")
 
 def resolve_languages():
     """
     Programmatically establish a duplicate-free mapping between Austronesian
     language family names and ISO codes so we can link WALS data to the MCC
-    tree.
+    tree.  Whenever an ISO code is shared by several languages in either
+    dataset, we look for a name used by both datasets for that ISO code.  If
+    there is one such common name, identify these as the same language and
+    kill all the others.  If there is no name overlap, kill everything.
     """
     a_mapping = load_austro_iso_names()
     w_mapping = load_wals_iso_names()
-    a_exclusions = []   # Austronesian MCC langs to drop
-    w_exclusions = []   # WALS langs to drop
-
-    a_exclusions.extend(l.lower() for l in a_mapping if a_mapping[l] == "XXX")
-
-    a_duped_isos = set([i for i in a_mapping.values() \
-            if list(a_mapping.values()).count(i) > 1])
-    # First, iterated over all ISO codes which are duplicated in the refrence
-    # Austronesian tree.  Get all of the names in the ref. tree which map to
-    # an ISO, and all of the names in WALS which map to that ISO.  Find the
-    # intersection (i.e. those names used by both).  If there is one such
-    # common name, identify these as the same language and kill all the
-    # others.  If there is no name overlap, kill everything.
-    for iso in a_duped_isos:
-        a_names = set([l.lower() for l in a_mapping if a_mapping[l] == iso])
-        w_names = set([l.lower() for l in w_mapping if w_mapping[l] == iso])
-        true_name = a_names.intersection(w_names)
-        if len(true_name) == 1:
-            # Keep the common name, kill others
-            a_exclusions.extend(a_names.difference(true_name))
-            w_exclusions.extend(w_names.difference(true_name))
-        else:
-            # Kill everything
-            a_exclusions.extend(a_names)
-            w_exclusions.extend(w_names)
-    # Now there might be ISO codes which are duplicates in WALS but not the
-    # reference tree.
-    w_duped_isos = set([i for i in w_mapping.values() \
-            if list(w_mapping.values()).count(i) > 1])
-    for iso in w_duped_isos:
-        a_names = set([l.lower() for l in a_mapping if a_mapping[l] == iso])
-        w_names = set([l.lower() for l in w_mapping if w_mapping[l] == iso])
-        true_name = a_names.intersection(w_names)
-        if len(true_name) == 1:
-            # Keep the common name, kill others
-            w_exclusions.extend(w_names.difference(true_name))
-        else:
-            w_exclusions.extend(w_names)
-    for l in list(a_mapping.keys()):
-        if l.lower() in set(a_exclusions):
-            a_mapping.pop(l)
-    for l in list(w_mapping.keys()):
-        if l.lower() in set(w_exclusions):
-            w_mapping.pop(l)
+    a_exclusions, a_mapping, w_exclusions, w_mapping = linking.link(
+            a_mapping, w_mapping, missing="XXX")
 
     # Save the mapping to a LaTeX table
     make_table(a_mapping, w_mapping)
@@ -85,7 +54,7 @@ def load_austro_iso_names():
     """
     Build a dictionary mapping Austronesian language names to ISO codes.
     """
-    fp = open("iso.austronesian.txt", "r")
+    fp = inputs.open_input("iso.austronesian.txt", "r")
     untranslatable = []
     mapping = {}
     # Separate languages with ISO codes from those without
@@ -95,18 +64,19 @@ def load_austro_iso_names():
     fp.close()
     return mapping
 
-def load_wals_iso_names():
+def load_wals_iso_names(key="iso_code"):
     """
-    Build a dictionary mapping WALS language names to ISO codes.
+    Build a dictionary mapping WALS language names to ISO codes, or to the
+    values of another column of language.csv given by key, e.g. glottocode
+    for linking to datasets which use Glottocodes.
     """
-    fp = open("language.csv","r")
+    fp = inputs.open_input("language.csv", "r")
     reader = csv.DictReader(fp)
     mapping = {}
     for row in reader:
-        if row["iso_code"] != "?":
-            mapping[row["Name"]] = row["iso_code"]
+        if row[key] != "?":
+            mapping[row["Name"]] = row[key]
     fp.close()
-    all_isos = [i for i in mapping.values()]
     return mapping
 
 def make_table(a_mapping, w_mapping):
@@ -133,45 +103,63 @@ def make_table(a_mapping, w_mapping):
     fp.write("\\end{tabular}\n")
     fp.close()
 
-def reformat_wals(exclusions):
-    """
-    Convert the WALS data file to CLDF format.
-    """
-    fp_in = open("language.csv","r")
-    fp_out = open("wals_data.csv","w")
-
-    reader = csv.DictReader(fp_in)
-
-    fn = reader.fieldnames
-    fn = [name.split()[0] if name[0].isdigit() else name for name in fn]
-    fn = ["iso" if name == "iso_code" else name for name in fn]
-    fn = [name for name in fn if name == "iso" or name[0].isdigit()]
-    fn.remove("95A")
-    fn.remove("96A")
-    fn.remove("97A")
-    fn.remove("iso")
-    fn.insert(0,"iso")
-
-    writer = csv.DictWriter(fp_out, fn)
-    writer.writeheader()
-
+def wals_columns(header):
+    """
+    Compile the column projection used by reformat_wals from the header of
+    language.csv.  Returns a list of (input column index, output column
+    name) pairs, with the ISO code first followed by every feature in input
+    order, except those in EXCLUDED_FEATURES.  Feature columns are renamed
+    to their IDs (e.g. "1A Consonant Inventories" becomes "1A").
+    """
+    iso = None
+    features = []
+    for i, name in enumerate(header):
+        if name == "iso_code":
+            iso = (i, "iso")
+        elif name[0].isdigit():
+            name = name.split()[0]
+            if name not in EXCLUDED_FEATURES:
+                features.append((i, name))
+    return [iso] + features
+
+def reformat_wals(exclusions, infile="language.csv", outfile="wals_data.csv",
+        chunksize=1000):
+    """
+    Convert the WALS data file to CLDF format.  The file is streamed through
+    the column projection compiled from its header, and output is written
+    chunksize rows at a time, so memory use does not depend on the size of
+    the input.
+    """
+    exclusions = set(exclusions)
+    fp_in = inputs.open_input(infile, "r")
+    fp_out = open(outfile,"w")
+    reader = csv.reader(fp_in)
+    writer = csv.writer(fp_out)
+
+    header = next(reader)
+    width = len(header)
+    name_col = header.index("Name")
+    columns = wals_columns(header)
+    indices = [i for i, name in columns]
+    writer.writerow([name for i, name in columns])
+
+    chunk = []
     for row in reader:
-        newrow = {}
-        if row["Name"].lower() in exclusions:
+        if row[name_col].lower() in exclusions:
+            continue
+        if len(row) < width:
+            row.extend([""]*(width - len(row)))
+        # Keep only the numeric part of coded values, e.g. "1 Small" -> "1"
+        newrow = [row[i].split()[0] if row[i] and row[i][0].isdigit()
+                else row[i] or "?" for i in indices]
+        if newrow[0] == "?":
             continue
-        for key in row.keys():
-            newkey = key.split()[0] if key[0].isdigit() else key
-            newkey = "iso" if newkey == "iso_code" else newkey
-            if newkey not in fn:
-                continue
-            val = row[key]
-            newval = val.split()[0] if val and val[0].isdigit() else val
-            newval = newval if newval else "?"
-            newrow[newkey] = newval
-        if newrow["iso"] == "?":
-                continue
-        writer.writerow(newrow)
-    
+        chunk.append(newrow)
+        if len(chunk) == chunksize:
+            writer.writerows(chunk)
+            chunk = []
+    writer.writerows(chunk)
+
     fp_in.close()
     fp_out.close()
 
@@ -180,7 +168,7 @@ def clean_reference_tree():
     Produce a copy of the file containing the MCC tree which consists of just
     a Newick-formatted tree, without any extraneous NEXUS syntax.
     """
-    fp_in = open("a400-m1pcv-time.mcct.trees", "r")
+    fp_in = inputs.open_input("a400-m1pcv-time.mcct.trees", "r")
     fp_out = open("austronesian_reference.nex", "w")
     for line in fp_in:
         # Skip comments and NEXUS cruft
@@ -197,33 +185,20 @@ def adjust_reference_tree(kill_list, translation):
     Remove unwanted languages from the reference tree and change the names of
     the languages we do want to ISO codes.
     """
-    tree = newick.read("austronesian_reference.nex")[0]
-    tree.remove_internal_names()
-    for n in tree.walk():
-        if n.name:
-            if n.name in translation:
-                # Replace name by ISO
-                n.name = translation[n.name]
-            else:
-                # Convert to lowercase to match kill list
-                n.name = n.name.lower()
-    # Remove languages not in WALS
-    tree.prune_by_names(kill_list)
-    # The pruning above will have left some un-named leaf nodes, so kill these
-    while None in tree.get_leaf_names():
-        unnamed_leaves = [
-            node
-            for node in tree.get_leaves()
-            if node.name is None]
-        tree.prune(unnamed_leaves)
-    # All of the above has likely left some redundant tree nodes, i.e. nodes
-    # with only one descendant, so get rid of these
-    tree.remove_redundant_nodes()
-    newick.write([tree], "processed_austronesian_reference.nex")
+    tree = trees.load_trees("austronesian_reference.nex")[0]
+    # Replace names by ISO codes, or convert them to lowercase to match the
+    # kill list, then remove languages not in WALS, unnamed leaves and
+    # internal names, and collapse the redundant nodes (those with only one
+    # descendant) which this leaves, all in a single pass
+    tree = tree.prune(drop=kill_list,
+            relabel=lambda name: translation.get(name, name.lower()),
+            internal_names=False)
+    fp = open("processed_austronesian_reference.nex", "w")
+    fp.write(tree.write_newick(length_format="%f"))
+    fp.close()
     # Save a BEASTling compatible list of ISO codes
-    isos = [n.name for n in tree.walk() if n.is_leaf]
     fp = open("language_list.txt", "w")
-    for iso in isos:
+    for iso in tree.leaf_names():
         fp.write("%s\n" % iso)
     fp.close()
 
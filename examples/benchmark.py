@@ -0,0 +1,277 @@
+#!/usr/bin/env python2
+"""
+Benchmark the stages of the pre- and postprocessing pipeline on synthetic
+data of configurable size.
+
+Synthetic inputs shaped like the real ones (a PIE.csv cognate table, a WALS
+language.csv, a BEAST trace log and a NEXUS tree sample) are generated in a
+scratch directory, then each stage is run in a fresh process so that its wall
+time, CPU time and peak memory use can be measured separately.  Results are
+saved as JSON, so runs can be compared between versions of the scripts.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import stages
+
+EXAMPLES = os.path.dirname(os.path.abspath(__file__))
+
+def write_cognate_table(filename, languages=20, meanings=110, seed=1):
+    """
+    Write a tab-delimited cognate table shaped like PIE.csv, with one row
+    per language and meaning.  About one value in twenty is a borrowing,
+    coded as a negative cognate class.
+    """
+    rng = random.Random(seed)
+    fp = open(filename, "w")
+    fp.write("# PIE\nID\tTaxon\tGloss\tGlossID\tIPA\tTokens\tCogID\n# \n")
+    row = 1
+    for m in range(meanings):
+        for l in range(languages):
+            cog = rng.randint(1, 5) + 10*m
+            if rng.random() < 0.05:
+                cog = -cog
+            form = "".join(rng.choice("aeioubdgklmnprst") for i in range(5))
+            fp.write("%d\tlang%d\tmeaning%d\t%d\t%s\t%s\t%d\n" % (
+                row, l, m, m + 1, form, " ".join(form), cog))
+            row += 1
+    fp.close()
+
+def write_wals_table(filename, languages=2679, features=192, seed=1):
+    """
+    Write a language table shaped like WALS's language.csv, with about half
+    of the feature values missing.
+    """
+    rng = random.Random(seed)
+    fp = open(filename, "w")
+    header = ["wals_code", "iso_code", "glottocode", "Name", "latitude",
+            "longitude", "genus", "family", "macroarea", "countrycodes"]
+    header.extend("%dA Feature %d" % (f + 1, f + 1) for f in range(features))
+    fp.write(",".join(header) + "\n")
+    for l in range(languages):
+        row = ["w%d" % l, "i%05d" % rng.randint(0, languages),
+                "lang%04d" % l, "Language %d" % l, "0.0", "0.0", "Genus",
+                "Family", "Eurasia", "XX"]
+        row.extend("%d Value" % rng.randint(1, 6) if rng.random() < 0.5
+                else "" for f in range(features))
+        fp.write(",".join(row) + "\n")
+    fp.close()
+
+def write_trace_log(filename, samples=10000, rates=100, seed=1, every=1000):
+    """
+    Write a BEAST trace log with the given number of samples of a posterior,
+    likelihood and prior and the given number of featureClockRate columns.
+    """
+    rng = np.random.RandomState(seed)
+    fp = open(filename, "w")
+    names = ["Sample", "posterior", "likelihood", "prior"]
+    names.extend("featureClockRate:bench:f%d" % r for r in range(rates))
+    fp.write("\t".join(names) + "\t\n")
+    block = 1000
+    for start in range(0, samples, block):
+        n = min(block, samples - start)
+        data = np.empty((n, len(names)))
+        data[:, 0] = (start + np.arange(n))*every
+        data[:, 1:4] = -rng.gamma(10, 100, (n, 3))
+        data[:, 4:] = rng.gamma(2, 0.5, (n, rates))
+        np.savetxt(fp, data, fmt=["%d"] + ["%f"]*(len(names) - 1),
+                delimiter="\t", newline="\t\n")
+    fp.close()
+
+def random_tree(rng, taxa, base=None):
+    """
+    Return a random ultrametric Newick tree on taxa numbered from 1, built by
+    joining random pairs of clusters.  If base is given, it is a list of
+    join steps to reuse, so that many trees share the same topology.
+    """
+    clusters = [(str(t + 1), 0.0) for t in range(taxa)]
+    steps = []
+    height = 0.0
+    while len(clusters) > 1:
+        if base:
+            i, j = base[len(steps)]
+        else:
+            i, j = sorted(rng.sample(range(len(clusters)), 2))
+        steps.append((i, j))
+        height += rng.expovariate(len(clusters))
+        (a, ha), (b, hb) = clusters[i], clusters[j]
+        del clusters[j]
+        clusters[i] = ("(%s:%.4f,%s:%.4f)" % (a, height - ha, b, height - hb),
+                height)
+    return clusters[0][0] + ";", steps
+
+def write_tree_sample(filename, trees=1000, taxa=20, seed=1):
+    """
+    Write a NEXUS tree sample with a translate block, as logged by BEAST.
+    Half of the trees share one topology, to give realistic clade supports.
+    """
+    rng = random.Random(seed)
+    base = random_tree(rng, taxa)[1]
+    fp = open(filename, "w")
+    fp.write("#NEXUS\n\nBegin trees;\n\tTranslate\n")
+    fp.write(",\n".join("\t\t%d taxon%d" % (t + 1, t + 1) for t in range(taxa)))
+    fp.write("\n;\n")
+    for i in range(trees):
+        newick = random_tree(rng, taxa, base if rng.random() < 0.5 else None)[0]
+        fp.write("tree STATE_%d = %s\n" % (i*1000, newick))
+    fp.write("End;\n")
+    fp.close()
+
+def _load(name, path):
+    """
+    Import the module in the file path under the given name, so that the
+    two examples' preprocess modules do not clash.
+    """
+    try:
+        import importlib.util
+    except ImportError:
+        import imp
+        return imp.load_source(name, path)
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def stage_format_data():
+    _load("ie_preprocess", os.path.join(EXAMPLES, "indoeuropean",
+        "preprocess.py")).format_data()
+
+def stage_reformat_wals():
+    _load("au_preprocess", os.path.join(EXAMPLES, "austronesian",
+        "preprocess.py")).reformat_wals(set())
+
+def stage_write_means():
+    import utils
+    utils.write_means("bench.log", "parameter_means.csv")
+
+def stage_build_cache():
+    import tracecache
+    tracecache.build("bench.log")
+
+def stage_cached_means():
+    import utils
+    utils.write_means("bench.log", "parameter_means.csv", cache=True)
+
+def stage_tree_sample():
+    import treesample
+    counter = treesample.CladeCounter()
+    mcc = treesample.MCCTree(counter, "bench.nex")
+    treesample.process("bench.nex", [counter, mcc], burnin=0.1)
+    mcc.write("mcct.nex")
+    counter.write("clades.txt")
+
+# Stages in the order they are run, with the input file each one reads
+STAGES = [
+    ("format_data", stage_format_data, "PIE.csv"),
+    ("reformat_wals", stage_reformat_wals, "language.csv"),
+    ("write_means", stage_write_means, "bench.log"),
+    ("build_cache", stage_build_cache, "bench.log"),
+    ("cached_means", stage_cached_means, "bench.log"),
+    ("tree_sample", stage_tree_sample, "bench.nex"),
+]
+
+def _run_stage(func, workdir, conn):
+    sys.path.insert(0, EXAMPLES)
+    os.chdir(workdir)
+    # The child starts with the memory of its parent, so measure the peak
+    # from here as the postprocessing scripts do (see stages.run_stage)
+    per_stage = stages.reset_peak_rss()
+    cpu = sum(os.times()[:2])
+    wall = time.time()
+    func()
+    wall = time.time() - wall
+    cpu = sum(os.times()[:2]) - cpu
+    key = "peak_rss_kb" if per_stage else "process_peak_rss_kb"
+    conn.send({"wall": wall, "cpu": cpu, key: stages.peak_rss()})
+    conn.close()
+
+def run_stage(func, workdir):
+    """
+    Run a stage function in a fresh process with workdir as its working
+    directory, and return its timings and peak memory use.  As in
+    stages.run_stage, the peak is saved as process_peak_rss_kb instead of
+    peak_rss_kb where it cannot be reset when the stage starts.
+    """
+    parent, child = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=_run_stage,
+            args=(func, workdir, child))
+    process.start()
+    result = parent.recv() if parent.poll(None) else None
+    process.join()
+    if process.exitcode:
+        raise RuntimeError("Stage failed with exit code %d" % process.exitcode)
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--languages", type=int, default=20,
+            help="Languages in the cognate table")
+    parser.add_argument("--meanings", type=int, default=110,
+            help="Meanings in the cognate table")
+    parser.add_argument("--wals-languages", type=int, default=2679,
+            help="Languages in the WALS table")
+    parser.add_argument("--features", type=int, default=192,
+            help="Features in the WALS table")
+    parser.add_argument("--samples", type=int, default=10000,
+            help="Samples in the trace log")
+    parser.add_argument("--rates", type=int, default=100,
+            help="featureClockRate columns in the trace log")
+    parser.add_argument("--trees", type=int, default=1000,
+            help="Trees in the tree sample")
+    parser.add_argument("--taxa", type=int, default=20,
+            help="Taxa in the tree sample")
+    parser.add_argument("--stages", nargs="+", metavar="STAGE",
+            choices=[name for name, func, infile in STAGES],
+            help="Stages to run (default all)")
+    parser.add_argument("-o", "--output", default="benchmark.json",
+            help="File to save results to")
+    parser.add_argument("--keep", action="store_true",
+            help="Keep the scratch directory of synthetic data")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="beastling_bench_")
+    print("Generating synthetic data in %s..." % workdir)
+    write_cognate_table(os.path.join(workdir, "PIE.csv"), args.languages,
+            args.meanings)
+    write_wals_table(os.path.join(workdir, "language.csv"),
+            args.wals_languages, args.features)
+    write_trace_log(os.path.join(workdir, "bench.log"), args.samples,
+            args.rates)
+    write_tree_sample(os.path.join(workdir, "bench.nex"), args.trees,
+            args.taxa)
+
+    results = []
+    for name, func, infile in STAGES:
+        if args.stages and name not in args.stages:
+            continue
+        result = run_stage(func, workdir)
+        result["stage"] = name
+        result["input_bytes"] = os.path.getsize(os.path.join(workdir, infile))
+        results.append(result)
+        print("%-14s %8.3fs wall %8.3fs CPU %8d KB peak RSS" % (
+            name, result["wall"], result["cpu"], result.get("peak_rss_kb",
+                result.get("process_peak_rss_kb"))))
+
+    sizes = dict((key, value) for key, value in vars(args).items()
+            if key not in ("stages", "output", "keep"))
+    report = {"sizes": sizes, "stages": results,
+            "python": platform.python_version(), "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+    fp = open(args.output, "w")
+    json.dump(report, fp, indent=2, sort_keys=True)
+    fp.close()
+    if not args.keep:
+        shutil.rmtree(workdir)
+
+if __name__ == "__main__":
+    main()
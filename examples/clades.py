@@ -0,0 +1,176 @@
+"""
+Integer bitset representation of clades in posterior tree samples.
+
+Each taxon name is assigned a bit position the first time it is seen, so
+that every clade (the set of leaves below a node of a rooted tree) becomes a
+single integer.  Counting clades, scoring trees and building consensus trees
+are then integer operations on a dictionary of counts, rather than
+operations on sets of strings.
+"""
+import math
+
+class CladeIndex(object):
+    """
+    Mapping between taxon names and bit positions, plus a table of how many
+    trees each clade has been seen in.
+    """
+
+    def __init__(self, taxa=()):
+        self.taxa = []
+        self.bits = {}
+        for name in taxa:
+            self.bit(name)
+        self.trees = 0
+        self.counts = {}
+
+    def bit(self, name):
+        """
+        Return the bitmask of the single taxon name, assigning it the next
+        free bit position if it has not been seen before.
+        """
+        if name not in self.bits:
+            self.bits[name] = 1 << len(self.taxa)
+            self.taxa.append(name)
+        return self.bits[name]
+
+    def mask(self, names):
+        """
+        Return the bitmask of the clade made up of the given taxa.
+        """
+        mask = 0
+        for name in names:
+            mask |= self.bit(name)
+        return mask
+
+    def names(self, mask):
+        """
+        Return the sorted list of names of the taxa in a clade bitmask.
+        """
+        # Find the set bits in the binary digits, lowest first, so only the
+        # taxa in the clade are visited
+        digits = bin(mask)[:1:-1]
+        names = []
+        i = digits.find("1")
+        while i >= 0:
+            names.append(self.taxa[i])
+            i = digits.find("1", i + 1)
+        return sorted(names)
+
+    def node_masks(self, tree):
+        """
+        Return a list of the bitmask of the clade of every node of a
+        trees.Tree, indexed by node.
+        """
+        parent = tree.parent.tolist()
+        leaf = tree.is_leaf().tolist()
+        label = tree.label.tolist()
+        names = tree.taxa.names
+        # Leaves are numbered from left to right in preorder, so bits are
+        # assigned in the same order as in a postorder walk
+        masks = [self.bit(names[label[node]]) if leaf[node] else 0
+                for node in range(len(parent))]
+        for node in range(len(parent) - 1, 0, -1):
+            masks[parent[node]] |= masks[node]
+        return masks
+
+    def clades(self, tree):
+        """
+        Return a list of the bitmasks of the clades of all internal nodes,
+        including the root, of a trees.Tree.
+        """
+        masks = self.node_masks(tree)
+        return [m for m, leaf in zip(masks, tree.is_leaf().tolist()) if not leaf]
+
+    def add(self, masks):
+        """
+        Count one tree, with the given list of clade bitmasks.
+        """
+        self.trees += 1
+        counts = self.counts
+        for mask in masks:
+            counts[mask] = counts.get(mask, 0) + 1
+
+    def add_tree(self, tree):
+        """
+        Count the clades of a trees.Tree, returning their bitmasks.
+        """
+        masks = self.clades(tree)
+        self.add(masks)
+        return masks
+
+    def merge(self, other):
+        """
+        Add the tree and clade counts of another CladeIndex to this one.
+        Bit positions are translated if the two indices assigned them in a
+        different order.
+        """
+        if other.taxa == self.taxa[:len(other.taxa)]:
+            translate = lambda mask: mask
+        else:
+            translate = lambda mask: self.mask(other.names(mask))
+        self.trees += other.trees
+        for mask, n in other.counts.items():
+            mask = translate(mask)
+            self.counts[mask] = self.counts.get(mask, 0) + n
+
+    def support(self, mask):
+        """
+        Return the proportion of trees in which a clade appears.
+        """
+        return self.counts.get(mask, 0) / float(self.trees)
+
+    def score(self, masks):
+        """
+        Return the log clade credibility of a tree, i.e. the sum of the log
+        supports of its clades.
+        """
+        trees = float(self.trees)
+        counts = self.counts
+        return math.fsum(math.log(counts[mask] / trees) for mask in masks)
+
+    def ranked(self):
+        """
+        Return a list of (support, names) pairs for every clade, from best
+        supported to worst supported, with ties sorted by name.
+        """
+        ranked = [(-n, self.names(mask)) for mask, n in self.counts.items()]
+        ranked.sort()
+        return [(-n / float(self.trees), names) for n, names in ranked]
+
+    def majority_rule(self, threshold=0.5):
+        """
+        Return the majority-rule consensus tree as a Newick string whose
+        internal nodes are labelled with clade supports.  Only clades with
+        support greater than threshold (which must be at least 0.5, so that
+        all such clades are compatible) are included.
+        """
+        limit = threshold*self.trees
+        # Every leaf is trivially in every tree
+        masks = [self.bits[name] for name in self.taxa]
+        masks.extend(m for m, n in self.counts.items() if n > limit
+                and m & (m - 1))
+        # Place each clade below the smallest larger clade containing it
+        masks.sort(key=lambda m: bin(m).count("1"))
+        children = dict((m, []) for m in masks)
+        roots = []
+        for i, mask in enumerate(masks):
+            for parent in masks[i+1:]:
+                if mask & parent == mask and parent != mask:
+                    children[parent].append(mask)
+                    break
+            else:
+                roots.append(mask)
+
+        # Children are smaller than their parents, so writing the clades from
+        # smallest to largest writes every child before its parent, without
+        # recursion
+        text = {}
+        for mask in masks:
+            if children[mask]:
+                text[mask] = "(%s)%0.6g" % (",".join(text[c]
+                    for c in children[mask]), self.support(mask))
+            else:
+                text[mask] = self.taxa[mask.bit_length() - 1]
+        if len(roots) == 1:
+            return text[roots[0]] + ";"
+        return "(%s);" % ",".join(text[r] for r in roots)
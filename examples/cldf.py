@@ -0,0 +1,75 @@
+"""
+Streaming conversion of cognate tables to CLDF format.
+
+Tables are read and written with the csv module, so fields containing
+commas or quotes (as glosses and IPA transcriptions often do) are quoted
+properly, and columns are found by name in the header rather than by
+position.  Rows are processed a block at a time, so the whole table is
+never held in memory and tables with millions of rows can be converted.
+"""
+import csv
+import io
+import itertools
+import sys
+
+import inputs
+
+# Rows to read and write at once
+BLOCK = 10000
+# Bytes of buffer for the input and output files
+BUFFER = 1 << 20
+
+def open_csv(filename, mode="r"):
+    """
+    Open filename for reading or writing with the csv module, as bytes under
+    Python 2 (where the csv module does not support unicode) and as UTF-8
+    text under Python 3.  Files to read may be compressed (see inputs).
+    """
+    if mode == "r":
+        if sys.version_info[0] < 3:
+            return inputs.open_input(filename, "rb", BUFFER)
+        return inputs.open_input(filename, "r", BUFFER, encoding="utf8",
+                newline="")
+    if sys.version_info[0] < 3:
+        return open(filename, mode + "b", BUFFER)
+    return io.open(filename, mode, BUFFER, encoding="utf8", newline="")
+
+def convert_cognates(infile, outfile, columns, delimiter="\t",
+        quoting=csv.QUOTE_MINIMAL, comment="#", block=BLOCK):
+    """
+    Convert the cognate table infile to the CLDF file outfile, renaming the
+    columns of infile according to the dictionary columns (which must map
+    some column to "Value", the cognate class) and keeping the others.
+    Blank lines and lines starting with comment are skipped, and
+    surrounding whitespace is stripped from all fields.  Negative cognate
+    classes indicate borrowings, which are replaced with missing data
+    points.  Returns the number of rows converted.
+    """
+    fp_in = open_csv(infile, "r")
+    fp_out = open_csv(outfile, "w")
+    lines = (line for line in fp_in
+            if line.strip() and not line.startswith(comment))
+    reader = csv.reader(lines, delimiter=delimiter, quoting=quoting)
+    writer = csv.writer(fp_out, lineterminator="\n")
+    header = [name.strip() for name in next(reader)]
+    missing = [name for name in columns if name not in header]
+    if missing:
+        raise ValueError("%s has no column(s) %s" % (infile,
+            ", ".join(missing)))
+    header = [columns.get(name, name) for name in header]
+    value = header.index("Value")
+    writer.writerow(header)
+    count = 0
+    while True:
+        rows = [[x.strip() for x in row]
+                for row in itertools.islice(reader, block)]
+        if not rows:
+            break
+        for row in rows:
+            if row[value].startswith("-"):
+                row[value] = "?"
+        writer.writerows(rows)
+        count += len(rows)
+    fp_out.close()
+    fp_in.close()
+    return count
@@ -0,0 +1,199 @@
+#!/usr/bin/env python2
+"""
+Merge the trace logs of several independent BEAST chains of the same
+analysis and check that they have converged.
+
+Each chain is summarised in its own worker process, from the columnar cache
+of its log (see tracecache), one group of columns at a time.  Effective
+sample sizes and split R-hat values are computed for every parameter at once
+using array operations, and the merged posterior means are saved in the same
+format as parameter_means.csv, so that they can be used by the existing
+table and figure code.  These means are computed as utils.write_means
+computes them (see utils.published_burnin and utils.total_means), so for a
+single chain the file is identical to the one write_means saves, while the
+diagnostics file holds the plain means of the post-burnin samples.
+"""
+import argparse
+import multiprocessing
+import numbers
+
+import numpy as np
+
+import tracecache
+import utils
+
+# Number of samples to hold in memory at once per chain
+GROUP_BUFFER = 8*1024*1024
+
+def autocorrelation(x):
+    """
+    Return the autocorrelation function of each column of the 2D array x,
+    computed via the FFT.
+    """
+    n = len(x)
+    x = x - x.mean(axis=0)
+    size = 1
+    while size < 2*n:
+        size *= 2
+    f = np.fft.rfft(x, size, axis=0)
+    acov = np.fft.irfft(f*np.conjugate(f), size, axis=0)[:n]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return acov/acov[0]
+
+def effective_sample_size(x):
+    """
+    Return the effective sample size of each column of the 2D array x, using
+    Geyer's initial monotone sequence estimator of the autocorrelation time.
+    Columns with no variation get an ESS of nan.
+    """
+    n = len(x)
+    rho = autocorrelation(x)
+    pairs = n // 2
+    # Sums of consecutive pairs of autocorrelations are positive, and
+    # decreasing, up to the point where noise takes over
+    gamma = rho[0:2*pairs:2] + rho[1:2*pairs:2]
+    positive = np.cumprod(gamma > 0, axis=0).astype(bool)
+    gamma = np.minimum.accumulate(np.where(positive, gamma, np.inf), axis=0)
+    tau = -1 + 2*np.where(positive, gamma, 0).sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        ess = n/np.maximum(tau, 1.0/np.log10(max(n, 10)))
+    ess[~np.isfinite(rho[0])] = np.nan
+    return ess
+
+def _chain_statistics(args):
+    """
+    Compute per-column statistics for the post-burnin samples of one chain:
+    sample size, mean, ESS and the means and variances of each half, and
+    the number of rows and the means of utils.write_means.
+    """
+    logfile, columns, burnin = args
+    cache = tracecache.load(logfile)
+    summary = cache.summarise(columns, utils.published_burnin(burnin,
+        cache.rows))
+    names, arrays = cache.select(columns)
+    skip = burnin if isinstance(burnin, numbers.Integral) else int(burnin*cache.rows)
+    n = cache.rows - skip
+    half = n // 2
+    stats = {"mean": np.empty(len(names)), "ess": np.empty(len(names)),
+            "half_mean": np.empty((2, len(names))),
+            "half_var": np.empty((2, len(names)))}
+    width = max(1, GROUP_BUFFER // max(1, n))
+    for start in range(0, len(names), width):
+        group = np.column_stack([a[skip:] for a in arrays[start:start+width]])
+        group = group.astype(float)
+        cols = slice(start, start + group.shape[1])
+        stats["mean"][cols] = group.mean(axis=0)
+        stats["ess"][cols] = effective_sample_size(group)
+        # Split the chain in two (dropping the middle sample of an odd
+        # number) for split R-hat
+        for i, part in enumerate((group[:half], group[n-half:])):
+            stats["half_mean"][i, cols] = part.mean(axis=0)
+            stats["half_var"][i, cols] = part.var(axis=0, ddof=1)
+    stats["n"] = n
+    stats["rows"] = cache.rows
+    stats["total_mean"] = utils.total_means(summary)
+    stats["names"] = names
+    return stats
+
+def split_rhat(half_means, half_vars, n):
+    """
+    Return the split R-hat statistic of each column, given 2D arrays of the
+    means and variances of each half-chain (one row per half-chain) and the
+    number of samples n in each half.
+    """
+    W = half_vars.mean(axis=0)
+    B = n*half_means.var(axis=0, ddof=1)
+    var_plus = (n - 1.0)/n*W + B/n
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.sqrt(var_plus/W)
+
+class ChainDiagnostics(object):
+    """
+    Merged means and convergence diagnostics for several chains.  mean is
+    the mean of all the post-burnin samples, and total_mean the merged
+    means of utils.write_means, weighted by the lengths of the chains.
+    """
+
+    def __init__(self, chains):
+        names = chains[0]["names"]
+        for chain in chains[1:]:
+            if chain["names"] != names:
+                raise ValueError("Chains do not log the same parameters")
+        self.names = names
+        self.chains = len(chains)
+        sizes = np.array([c["n"] for c in chains], dtype=float)
+        self.samples = int(sizes.sum())
+        means = np.array([c["mean"] for c in chains])
+        self.mean = (means*sizes[:, None]).sum(axis=0)/sizes.sum()
+        rows = np.array([c["rows"] for c in chains], dtype=float)
+        # Weights of exactly 1 for a single chain, so that its means are
+        # those of write_means to the last bit
+        self.total_mean = (np.array([c["total_mean"] for c in chains])
+                *(rows/rows.sum())[:, None]).sum(axis=0)
+        self.ess = np.array([c["ess"] for c in chains]).sum(axis=0)
+        # Half-chains must all be the same length, so use the shortest
+        half = min(c["n"] // 2 for c in chains)
+        self.rhat = split_rhat(
+                np.vstack([c["half_mean"] for c in chains]),
+                np.vstack([c["half_var"] for c in chains]), half)
+
+    def save(self, filename):
+        """
+        Save the merged mean, ESS and R-hat of every parameter to filename.
+        """
+        fp = open(filename, "w")
+        fp.write("parameter,mean,ess,rhat\n")
+        for row in zip(self.names, self.mean, self.ess, self.rhat):
+            fp.write("%s,%f,%.1f,%.4f\n" % row)
+        fp.close()
+
+def diagnose(logfiles, columns=utils.is_rate, burnin=0.1, processes=None):
+    """
+    Summarise the selected columns of several chains' logfiles in a pool of
+    processes, returning a ChainDiagnostics.  The columns argument must be
+    picklable, e.g. a module-level function, for use by the pool.
+    """
+    processes = processes or min(len(logfiles), multiprocessing.cpu_count())
+    pool = multiprocessing.Pool(processes)
+    chains = pool.map(_chain_statistics,
+            [(logfile, columns, burnin) for logfile in logfiles])
+    pool.close()
+    pool.join()
+    return ChainDiagnostics(chains)
+
+def burnin_value(value):
+    """
+    Parse a burnin option: an integer is a number of samples, anything else
+    a fraction of each chain.
+    """
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge BEAST chains and "
+            "compute ESS and split R-hat for every featureClockRate parameter.")
+    parser.add_argument("logfiles", nargs="+", help="BEAST log files")
+    parser.add_argument("-b", "--burnin", type=burnin_value, default=0.1,
+            help="Number of samples, or fraction, of each chain to discard "
+            "as burnin")
+    parser.add_argument("-j", "--processes", type=int, default=None,
+            help="Number of worker processes")
+    parser.add_argument("-o", "--output", default="parameter_means.csv",
+            help="File to save the ranked merged means to")
+    parser.add_argument("-d", "--diagnostics", default="convergence.csv",
+            help="File to save the per-parameter diagnostics to")
+    args = parser.parse_args()
+
+    diagnostics = diagnose(args.logfiles, burnin=args.burnin,
+            processes=args.processes)
+    utils.save_means(utils.rank_means(diagnostics.names,
+        diagnostics.total_mean), args.output)
+    diagnostics.save(args.diagnostics)
+    worst = np.nanmax(diagnostics.rhat) if len(diagnostics.names) else np.nan
+    print("Merged %d chains, %d samples.  Minimum ESS %.1f, maximum R-hat %.3f." % (
+        diagnostics.chains, diagnostics.samples, np.nanmin(diagnostics.ess), worst))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python2
+"""
+Stand-in for BEAST (and BEASTling) for testing the scheduler without
+running real analyses.
+
+Given a BEAST XML file, this reads the chain length, the loggers and the
+featureClockRate parameters from it, then writes a synthetic trace log (and
+tree log, if the XML asks for one) a few rows at a time over the requested
+number of seconds, so that progress can be followed as with a real chain.
+Given a BEASTling config (a .conf file) instead, it writes a minimal XML
+file describing the same analysis to the working directory.  Set the environment variable
+FAKEBEAST_FAILURE_RATE to a probability to make some runs fail.
+"""
+import argparse
+import csv
+import os
+import random
+import sys
+import time
+import xml.etree.ElementTree as ET
+try:
+    import ConfigParser as configparser
+except ImportError:
+    import configparser
+
+import numpy as np
+
+import benchmark
+
+def expand_plates(root):
+    """
+    Return the ids of all featureClockRate parameters in the XML tree root,
+    expanding BEAST plates such as featureClockRate:mk:$(feature).
+    """
+    ids = []
+    def visit(element, bindings):
+        if element.tag == "plate":
+            for value in element.get("range").split(","):
+                b = dict(bindings)
+                b[element.get("var")] = value
+                for child in element:
+                    visit(child, b)
+            return
+        id_ = element.get("id", "")
+        if element.tag == "parameter" and id_.startswith("featureClockRate:"):
+            for var, value in bindings.items():
+                id_ = id_.replace("$(%s)" % var, value)
+            ids.append(id_)
+        for child in element:
+            visit(child, bindings)
+    visit(root, {})
+    return ids
+
+def read_features(datafile):
+    """
+    Return the feature IDs in a CLDF data file, in either the long
+    (Language_ID, Feature_ID, Value) or the wide (one column per feature)
+    format.
+    """
+    fp = open(datafile, "r")
+    reader = csv.reader(fp)
+    header = next(reader)
+    if "Feature_ID" in header:
+        col = header.index("Feature_ID")
+        features = sorted(set(row[col] for row in reader))
+    else:
+        features = header[1:]
+    fp.close()
+    return features
+
+def fake_beastling(config):
+    """
+    Write a minimal BEAST XML file for a BEASTling config, with one
+    featureClockRate parameter for every feature of every model.
+    """
+    parser = configparser.RawConfigParser()
+    parser.read(config)
+    basename = parser.get("admin", "basename")
+    directory = os.path.dirname(os.path.abspath(config))
+    beast = ET.Element("beast")
+    run = ET.SubElement(beast, "run", chainLength=parser.get("MCMC", "chainlength"))
+    for section in parser.sections():
+        if not section.startswith("model "):
+            continue
+        model = section.split(" ", 1)[1]
+        datafile = os.path.join(directory, parser.get(section, "data"))
+        for feature in read_features(datafile):
+            ET.SubElement(run, "parameter",
+                    id="featureClockRate:%s:%s" % (model, feature))
+    ET.SubElement(run, "logger", fileName=basename + ".log", logEvery="1000")
+    ET.ElementTree(beast).write(basename + ".xml")
+
+def fake_beast(xmlfile, seconds, seed):
+    """
+    Write synthetic logs for the analysis described by xmlfile, spread over
+    the given number of seconds.
+    """
+    root = ET.parse(xmlfile).getroot()
+    run = root.find("run")
+    chainlength = int(run.get("chainLength"))
+    rates = expand_plates(root)
+    rng = np.random.RandomState(seed)
+    failure_rate = float(os.environ.get("FAKEBEAST_FAILURE_RATE", 0))
+    fail_at = rng.random_sample() if rng.random_sample() < failure_rate else None
+
+    tracelog = treelog = None
+    for logger in root.iter("logger"):
+        if not logger.get("fileName"):
+            continue
+        if logger.get("mode") == "tree":
+            treelog = open(logger.get("fileName"), "w")
+            treelog.write("#NEXUS\n\nBegin trees;\n")
+        else:
+            tracelog = open(logger.get("fileName"), "w")
+            every = int(logger.get("logEvery"))
+            tracelog.write("\t".join(["Sample", "posterior"] + rates) + "\t\n")
+
+    samples = chainlength // every + 1
+    steps = 20
+    taxa = 10
+    for step in range(steps):
+        rows = range(step*samples // steps, (step + 1)*samples // steps)
+        for row in rows:
+            values = rng.gamma(2, 0.5, len(rates))
+            tracelog.write("%d\t%f\t%s\t\n" % (row*every, -rng.gamma(10, 100),
+                "\t".join("%f" % v for v in values)))
+            if treelog:
+                newick = benchmark.random_tree(random.Random(row), taxa)[0]
+                treelog.write("tree STATE_%d = %s\n" % (row*every, newick))
+        tracelog.flush()
+        if fail_at is not None and step >= fail_at*steps:
+            sys.stderr.write("Fake BEAST failing %d%% of the way through\n"
+                    % (100*(step + 1)//steps))
+            sys.exit(1)
+        time.sleep(float(seconds)/steps)
+    tracelog.close()
+    if treelog:
+        treelog.write("End;\n")
+        treelog.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("input", help="BEAST XML file or BEASTling config")
+    parser.add_argument("--seconds", type=float, default=10,
+            help="How long the fake chain should take to run")
+    parser.add_argument("-seed", "--seed", type=int, default=None)
+    # Accepted, and mostly ignored, for compatibility with BEAST
+    parser.add_argument("-overwrite", action="store_true")
+    parser.add_argument("-working", action="store_true")
+    parser.add_argument("-java", action="store_true")
+    parser.add_argument("-threads", type=int, default=1)
+    parser.add_argument("--overwrite", action="store_true", dest="overwrite")
+    args = parser.parse_args()
+    if args.input.endswith(".conf"):
+        fake_beastling(args.input)
+        return
+    if args.working:
+        os.chdir(os.path.dirname(os.path.abspath(args.input)))
+    fake_beast(os.path.basename(args.input) if args.working else args.input,
+            args.seconds, args.seed)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python2
+"""
+Follow a BEAST log while the chain is still running, periodically rewriting
+the ranked posterior mean featureClockRate parameters.  For example, from
+examples/indoeuropean:
+
+    python ../follow.py indoeuropean.log --config indoeuropean.conf
+"""
+import argparse
+import sys
+try:
+    import ConfigParser as configparser
+except ImportError:
+    import configparser
+
+import utils
+
+def read_chainlength(config):
+    """
+    Read the chain length from the [MCMC] section of a BEASTling config.
+    """
+    parser = configparser.RawConfigParser()
+    parser.read(config)
+    return parser.getint("MCMC", "chainlength")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("logfile", help="BEAST log file being written")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("-c", "--config", help="BEASTling config of the analysis")
+    group.add_argument("-n", "--chainlength", type=int, help="Length of the chain")
+    parser.add_argument("-b", "--burnin", type=float, default=0.1,
+            help="Fraction of the chain to discard as burnin")
+    parser.add_argument("-i", "--interval", type=float, default=60,
+            help="Seconds between updates")
+    parser.add_argument("-o", "--output", default="parameter_means.csv",
+            help="File to save the ranked means to")
+    parser.add_argument("-t", "--timeout", type=float, default=None,
+            help="Give up after this many seconds without new samples")
+    parser.add_argument("-p", "--pid", type=int, default=None,
+            help="Give up if the process with this ID (e.g. BEAST) exits "
+            "before the chain is finished")
+    args = parser.parse_args()
+    chainlength = args.chainlength or read_chainlength(args.config)
+    try:
+        utils.follow_means(args.logfile, args.output, chainlength, args.burnin,
+                args.interval, args.timeout, args.pid)
+    except RuntimeError as e:
+        print(e)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,72 +1,120 @@
 #!/usr/bin/env python2
-import csv
-import subprocess
-import sys
+"""
+Postanalysis of the indoeuropean.log and indoeuropean.nex files generated
+by BEAST when the Indo-European analysis is run.  This will find the
+maximum clade credibility tree and try to generate a plot of it, as well
+as compute the ranking of meaning classes by posterior mean mutation rate
+and compare this ranking to others from the literature.
 
-import pandas as pd
-import matplotlib.pyplot as plt
-import scipy.stats
-import seaborn as sns
+Each of these is a stage which can be run on its own, e.g. "python
+postprocess.py means correlations".  The means are computed once and
+shared by the later stages, which read them back from parameter_means.csv
+only if they are run without the means stage.
+"""
+import importlib
+import sys
 
-import ete2
-try:
-    import ete2.treeview
-    _CAN_PLOT = True
-except ImportError:
-    _CAN_PLOT = False
+import numpy as np
 
 sys.path.append("..")
+import rankings
+import references
+import results
+import stages
+import tracecache
+import treesample
 import utils
 
-def main():
+def mcc(args):
     """
-    Postanalysis of the indoeuropean.log and indoeuropean.nex files generated
-    by BEAST when the Indo-European analysis is run.  This will find the
-    maximum clade credibility tree and try to generate a plot of it, as well
-    as compute the ranking of meaning classes by posterior mean mutation rate
-    and compare this ranking to others from the literature.
+    Summarise the tree sample, using args.processes processes, and plot
+    the maximum clade credibility tree if possible.
     """
-
-    print("Finding maximum clade credibility tree...")
-    find_mcc_tree()
-    print("Computing clade credibilities...")
-    compute_clade_probabilities()
-    if _CAN_PLOT:
-        print("Plotting maximum clade credibility tree...")
-        plot_mcc_tree()
-    else:
+    summarise_tree_sample(args.processes)
+    try:
+        importlib.import_module("ete2.treeview")
+    except ImportError:
         print("Skipping plotting tree due to lack of PyQt4 support. :(")
-    print("Computing posterior mean paramter estimates...")
-    ranked_means = utils.write_means("indoeuropean.log", "parameter_means.csv")
-    print("Computing ranking correlations...")
-    compute_ranking_correls(ranked_means)
-    print("Generating LaTeX table...")
-    make_table(ranked_means)
-    print("Generating rate variation figure...")
-    make_figure("category_rates.eps")
+        return
+    print("Plotting maximum clade credibility tree...")
+    plot_mcc_tree()
 
-def find_mcc_tree():
+def describe(analysis, categories):
     """
-    Use the phyltr program to find the maximum clade credibility tree
-    for this analysis, and save it to the file mcct.nex.
+    Name the meaning classes of an AnalysisResults, and categorise them
+    according to the mapping file categories.
     """
-    command = "phyltr cat -b 10 --no-annotation indoeuropean.nex | " \
-            "phyltr support --sort | " \
-            "head -n 1 > mcct.nex"
-    subprocess.call(command, shell=True)
+    analysis.set_names(lambda meaning: meaning.rsplit(" ", 1)[0]
+            if meaning.endswith("(V)") else meaning)
+    mapping, order = results.load_categories(categories)
+    analysis.set_categories(mapping.get, order)
+    return analysis
+
+def analysis_results(args):
+    """
+    Return the AnalysisResults computed by the means stage, if it was run,
+    or else read them from parameter_means.csv.
+    """
+    if getattr(args, "results", None) is None:
+        args.results = describe(results.load("parameter_means.csv"),
+                args.categories)
+    return args.results
+
+def means(args):
+    args.results = describe(results.from_log("indoeuropean.log", cache=True),
+            args.categories)
+    args.results.export("parameter_means.csv")
+    args.results.export_intervals("parameter_intervals.csv")
 
-def compute_clade_probabilities():
+def ranks(args):
+    utils.write_rank_uncertainty("indoeuropean.log", "rank_uncertainty.csv",
+            cache=True)
+
+def correlations(args):
+    compute_ranking_correls(analysis_results(args))
+
+def tables(args):
+    make_table(analysis_results(args))
+
+def figures(args):
+    make_figure(analysis_results(args), "category_rates.eps")
+
+STAGES = [
+    ("mcc", mcc,
+        "Finding maximum clade credibility tree and clade credibilities"),
+    ("means", means, "Computing posterior mean paramter estimates"),
+    ("ranks", ranks, "Computing posterior rank distributions"),
+    ("correlations", correlations, "Computing ranking correlations"),
+    ("tables", tables, "Generating LaTeX table"),
+    ("figures", figures, "Generating rate variation figure"),
+]
+
+def summarise_tree_sample(processes=1):
     """
-    Use the phyltr program to compute clade probabilities and save them
-    to the file clades.txt.
+    Read the posterior tree sample once, discarding 10% burnin, to find the
+    maximum clade credibility tree for this analysis and the credibilities
+    of all clades, and save them to the files mcct.nex and clades.txt.  With
+    more than one process, the sample is split into shards which are
+    processed in parallel instead, giving identical results.
     """
-    command = "phyltr cat -b 10 indoeuropean.nex | phyltr clades > clades.txt"
-    subprocess.call(command, shell=True)
+    if processes > 1:
+        index, offset = treesample.parallel_summary("indoeuropean.nex",
+                burnin=0.1, processes=processes)
+        treesample.write_mcc_tree("indoeuropean.nex", index, offset, "mcct.nex")
+        treesample.write_clades(index, "clades.txt")
+        return
+    counter = treesample.CladeCounter()
+    mcc = treesample.MCCTree(counter, "indoeuropean.nex")
+    treesample.process("indoeuropean.nex", [counter, mcc], burnin=0.1)
+    mcc.write("mcct.nex")
+    counter.write("clades.txt")
 
 def plot_mcc_tree():
     """
     Use ETE2 to save a PDF image of the tree stored in the mcct.nex file.
     """
+    import ete2
+    import ete2.treeview
     t = ete2.Tree("mcct.nex")
     ts = ete2.treeview.TreeStyle()
     ts.show_scale = False
@@ -100,6 +148,7 @@ def style_func(node):
     """
     ETE2 styling function.
     """
+    import ete2
     # Get rid of dots
     node.img_style["size"]=0
     node.img_style["hz_line_width"] = 2
@@ -120,108 +169,49 @@ def style_func(node):
         node.img_style["hz_line_type"] = line_type
         node.img_style["vt_line_type"] = line_type
 
-def compute_ranking_correls(ranked_means):
+def meaning_key(name):
     """
-    Compute the correlation coefficient between our ranking of meaning
-    classes by stability against three other published rankings.
+    Return the lower-cased meaning class of a featureClockRate parameter,
+    without any " (V)" suffix, to match the glosses of the reference
+    rankings.
     """
-    ranked_means = [w.split(":")[-1].lower() for (r,w) in ranked_means]
-    ranked_means = [w[:-4] if w.endswith(" (v)") else w for w in ranked_means]
-
-    correlations = []
-    starostin = load_starostin_ranking()
-    starostin = [s for s in starostin if s in ranked_means]
-    posterior = [p for p in ranked_means if p in starostin]
-    starostin = [starostin.index(w) for w in posterior]
-    posterior = [posterior.index(w) for w in posterior]
-    correlations.append(scipy.stats.spearmanr(posterior, starostin)[0])
-
-    swadesh = load_swadesh_ranking()
-    swadesh = [s for s in swadesh if s in ranked_means]
-    posterior = [p for p in ranked_means if p in swadesh]
-    swadesh = [swadesh.index(w) for w in posterior]
-    posterior = [posterior.index(w) for w in posterior]
-    correlations.append(scipy.stats.spearmanr(posterior, swadesh)[0])
+    return references.normalise(name.split(":")[-1], ("lower", "verb"))
 
-    pagel = load_pagel_ranking()
-    pagel = [s for s in pagel if s in ranked_means]
-    posterior = [p for p in ranked_means if p in pagel]
-    pagel = [pagel.index(w) for w in posterior]
-    posterior = [posterior.index(w) for w in posterior]
-    correlations.append(scipy.stats.spearmanr(posterior, pagel)[0])
+def compute_ranking_correls(analysis, replicates=1000):
+    """
+    Compute the correlation coefficient between our ranking of meaning
+    classes by stability against three other published rankings, and
+    against the mean of the Starostin and Swadesh rankings.  Bootstrap
+    resamples of the posterior samples give 95% intervals for the Spearman
+    correlations, which are saved with Kendall's tau in
+    ranking_correlations.csv.
+    """
+    keys = [meaning_key(w) for w in analysis.parameters]
+    starostin = references.load("starostin")
+    swadesh = references.load("swadesh")
+    aligned = rankings.align(keys, [starostin, swadesh,
+        references.load("pagel"), rankings.mean_ranking([starostin, swadesh], keys)])
+    correlations = rankings.spearman(np.arange(len(keys)), aligned)
+    taus = rankings.kendall(np.arange(len(keys)), aligned)
 
-    starostin = load_starostin_ranking()
-    swadesh = load_swadesh_ranking()
-    starostin = [s for s in starostin if s in ranked_means and s in swadesh]
-    swadesh = [s for s in swadesh if s in ranked_means and s in starostin]
-    posterior = [p for p in ranked_means if p in starostin and p in swadesh]
-    starostin = [starostin.index(w) for w in posterior]
-    swadesh = [swadesh.index(w) for w in posterior]
-    posterior = [posterior.index(w) for w in posterior]
-    mean = [(st+sw)/2.0 for st,sw in zip(starostin,swadesh)]
-    correlations.append(scipy.stats.spearmanr(posterior, mean)[0])
+    cache = tracecache.load("indoeuropean.log")
+    skip = int(0.1*cache.rows)
+    samples = np.column_stack([cache.column(w)[skip:] for w in analysis.parameters])
+    replicated = rankings.bootstrap(samples, aligned, replicates, seed=1)
+    lower, upper = np.percentile(replicated, [2.5, 97.5], axis=0)
 
-    for l, c in zip(("starostin", "swadesh", "pagel", "mean"), correlations):
+    names = ("starostin", "swadesh", "pagel", "mean")
+    for l, c in zip(names, correlations):
         fp = open("%s_correlation.txt" % l, "w")
         fp.write("%.2f" % c)
         fp.close()
-
-def load_starostin_ranking():
-    """
-    Load the ranking of meaning classes by stability provided by Starostin.
-    """
-    ranking = []
-    fp = open("Starostin-2007-110.tsv", "r")
-    r = csv.DictReader(fp, delimiter="\t")
-    for row in r:
-        word = row["GLOSS"].lower()
-        word = "walk" if word =="walk(go)" else word
-        rank = int(row["NUMBER"])
-        ranking.append((rank, word))
+    fp = open("ranking_correlations.csv", "w")
+    fp.write("reference,spearman,lower,upper,kendall\n")
+    for row in zip(names, correlations, lower, upper, taus):
+        fp.write("%s,%.4f,%.4f,%.4f,%.4f\n" % row)
     fp.close()
-    ranking.sort()
-    return [w for (n,w) in ranking]
 
-def load_swadesh_ranking():
-    """
-    Load the ranking of meaning classes by stability provided by Swadesh.
-    """
-    ranking = []
-    fp = open("Swadesh-1955-215.tsv", "r")
-    r = csv.DictReader(fp, delimiter="\t")
-    for row in r:
-        word = row["ENGLISH"].lower()
-        if word.startswith("*"):
-            word = word[1:]
-        if "(" in word:
-            word = word.split("(")[0].strip()
-        rank = int(row["STABILITY_SCORE"])
-        ranking.append((rank, word))
-    fp.close()
-    ranking.sort()
-    ranking.reverse()
-    return [w for (n,w) in ranking]
-
-def load_pagel_ranking():
-    """
-    Load the ranking of meaning classes by stability provided by Pagel.
-    """
-    ranking = []
-    fp = open("Pagel-2007-200.tsv", "r")
-    r = csv.DictReader(fp, delimiter="\t")
-    for row in r:
-        word = row["ENGLISH"].lower()
-        if "(" in word:
-            word = word.split("(")[0].strip()
-        if word.startswith("to "):
-            word = word.split(" ",1)[1]
-        rank = float(row["MEAN_RATE"])
-        ranking.append((rank, word))
-    fp.close()
-    ranking.sort()
-    return [w for (n,w) in ranking]
-
-def make_table(ranked_means):
+def make_table(analysis):
     """
     Generate a LaTeX table of fastest and slowest meaning classes and save it
     in the file table.tex for inclusion in the manuscript.
@@ -232,13 +222,10 @@ def make_table(ranked_means):
     \\multicolumn{2}{|c||}{Slowest} & \\multicolumn{2}{|c|}{Fastest} \\\\ \\hline
     Feature & Rate  & Feature & Rate \\\\ \\hline
 """)
-    top_10 = ranked_means[0:10]
-    bottom_10 = ranked_means[-10:]
+    ranked = list(zip(analysis.means, analysis.names))
+    top_10 = ranked[0:10]
+    bottom_10 = ranked[-10:]
     for ((f_rate, f_name),(s_rate,s_name)) in zip(top_10, bottom_10):
-        f_name = f_name.split(":")[-1]
-        f_name = f_name.rsplit(" ", 1)[0] if f_name.endswith("(V)") else f_name
-        s_name = s_name.split(":")[-1]
-        s_name = s_name.rsplit(" ", 1)[0] if s_name.endswith("(V)") else s_name
         fp.write("  %s & %.2f & %s & %.2f \\\\ \n" % \
                 (f_name, f_rate, s_name, s_rate))
     fp.write("\\hline\n")
@@ -251,41 +238,37 @@ def make_table(ranked_means):
     Meaning & Category & Meaning & Category & Meaning & Category & Meaning & Category\\\\ \\hline
 
 """)
-    feature_names = [f.split(":")[-1] for (r,f) in ranked_means]
-    feature_names.sort(key=lambda s: s.lower())
-    col1 = feature_names[0:25]
-    col2 = feature_names[25:50]
-    col3 = feature_names[50:75]
-    col4 = feature_names[75:]
+    meanings = sorted(zip(analysis.ids, analysis.names, analysis.categories),
+            key=lambda m: m[0].lower())
+    col1 = meanings[0:25]
+    col2 = meanings[25:50]
+    col3 = meanings[50:75]
+    col4 = meanings[75:]
     for a,b,c,d in zip(col1,col2,col3,col4):
-        x,y,z,w = [get_meaning_category(i) or "Excluded" for i in (a,b,c,d)]
-        # Lop off (V)s (we needed them above for get_meaning_category to work)
-        a,b,c,d = [f.rsplit(" ", 1)[0] if f.endswith("(V)") else f for f in (a,b,c,d)]
-        fp.write("%s & %s & %s & %s & %s & %s & %s & %s\\\\ \n" % (a, x, b, y, c, z, d, w))
+        cells = []
+        for f_id, name, category in (a,b,c,d):
+            cells += [name, category or "Excluded"]
+        fp.write("%s & %s & %s & %s & %s & %s & %s & %s\\\\ \n" % tuple(cells))
     fp.write("\\hline\n")
     fp.write("\\end{tabular}\n")
     fp.close()
 
-def make_figure(filename):
+def make_figure(analysis, filename):
     """
     Generate an image file for Figure 3 in the paper, showing the distribution
     of relative rates for different meaning class categories.
     """
-    # Read mean feature rates
-    fp = open("parameter_means.csv", "r")
-    mean_rates = {}
-    for line in fp:
-        feature, rate = line.strip().split(",")
-        feature = feature.split(":")[-1]
-        mean_rates[feature] = float(rate)
-    fp.close()
+    import pandas as pd
+    import matplotlib.pyplot as plt
+    import seaborn as sns
 
-    # Build a DataFrame
-    categories = ["Verb","Noun","Body part","Pronoun","Adjective","Colour"]
-    dataframes = []
-    for category in categories:
-        dataframes.append(pd.DataFrame({category:[mean_rates[f] for f in mean_rates if get_meaning_category(f) == category]}))
-    df = pd.concat(dataframes)
+    # Build a DataFrame with one column of rates per category, grouping
+    # them all at once
+    rates = pd.DataFrame({"category": analysis.categories,
+        "rate": analysis.means}).dropna()
+    df = pd.DataFrame(dict((category, group.reset_index(drop=True))
+        for category, group in rates.groupby("category")["rate"]))
+    categories = analysis.category_order
 
     # Plot it
     fig = plt.figure()
@@ -301,26 +284,11 @@ def make_figure(filename):
     # Save at PLoS's maximum permitted DPI
     plt.savefig(filename, dpi=600)
 
-def get_meaning_category(meaning):
-    if meaning.endswith("(V)"):
-        return "Verb"
-    elif meaning in "belly breast ear eye foot hair hand head heart knee liver mouth neck nose tongue tooth skin bone".split():
-        return "Body part"
-    elif meaning in "big cold far full good heavy long near new round short small thin warm dry many".split():
-        return "Adjective"
-    elif meaning in "black green red yellow white".split():
-        return "Colour"
-    elif meaning in "I thou we who what this that all".split():
-        return "Pronoun"
-    # There's only one adverb, so forget it
-    elif meaning == "not":
-        return None
-    # There are only two numbers, so they don't plot well
-    elif meaning in "one two".split():
-        return None
-    # Everything else is a boring old noun
-    else:
-        return "Noun"
-
 if __name__ == "__main__":
-    main()
+    parser = stages.parser(STAGES, __doc__.split("\n\n")[0].strip())
+    parser.add_argument("-j", "--processes", type=int, default=1,
+            help="Number of processes to use for the tree sample")
+    parser.add_argument("-c", "--categories", default="categories.csv",
+            help="CSV file mapping meaning classes to categories")
+    stages.main(STAGES, parser, __file__,
+            ["indoeuropean.log", "indoeuropean.nex"])
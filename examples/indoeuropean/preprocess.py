@@ -1,42 +1,40 @@
 #!/usr/bin/env python2
-import codecs
+import csv
+import sys
+import time
+
+sys.path.append("..")
+import cldf
+import matrix
+
+# Names of the columns of the original data in CLDF format
+COLUMNS = {
+    "Taxon": "Language_ID",
+    "Gloss": "Feature_ID",
+    "CogID": "Value",
+}
 
 def main():
     """
     Prepare the cognate data for the Indo-European analysis.  This just
     involves some minor recoding of the original data file to put it
-    in CLDF format.
+    in CLDF format, which is then encoded as a binary matrix.
     """
     format_data()
+    matrix.encode_config("indoeuropean.conf")
 
-def format_data():
+def format_data(infile="PIE.csv", outfile="indoeuropean.csv"):
     """
     Convert the original data file to CLDF format.
     """
-    fp_in = codecs.open("PIE.csv", "r", "UTF8")
-    header = True
-    fp_out = codecs.open("indoeuropean.csv", "w", "UTF8")
-    for line in fp_in:
-        # Skip comment lines.
-        if line.startswith("#"):
-            continue
-        # Despite being called PIE.csv, the original data is tab-delimited.
-        row = [x.strip() for x in line.split("\t")]
-        # Change column names to CLDF format
-        if header:
-            row[1] = "Language_ID"
-            row[2] = "Feature_ID"
-            row[6] = "Value"
-            header = False
-        # Negative cognate classes indicate borrowings.
-        # Replace these with missing data points.
-        elif int(row[-1]) < 0:
-            row[-1] = "?"
-        # Reassemble the row with commas instead of tabs
-        row = ",".join(row) + "\n"
-        fp_out.write(row)
-    fp_out.close
-    fp_in.close()
+    start = time.time()
+    # Despite being called PIE.csv, the original data is tab-delimited, and
+    # quote characters in it are part of the data
+    rows = cldf.convert_cognates(infile, outfile, COLUMNS, delimiter="\t",
+            quoting=csv.QUOTE_NONE)
+    elapsed = max(time.time() - start, 1e-6)
+    print("Converted %d rows in %.2f seconds (%d rows per second)"
+            % (rows, elapsed, rows/elapsed))
 
 if __name__ == "__main__":
     main()
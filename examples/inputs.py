@@ -0,0 +1,237 @@
+"""
+Transparent reading of compressed input files.
+
+BEAST logs and tree samples compress very well, and archived runs are
+usually kept as .gz, .xz or .bz2 files.  open_input opens any of these, or
+an uncompressed file, as if it were the plain text.  The compression is
+recognised from the first bytes of the file rather than its name, and a
+name such as indoeuropean.log is also found as indoeuropean.log.gz (or .xz
+or .bz2) if the plain file does not exist, so that the postprocessing
+scripts run on archived output without decompressing it to disk first.
+
+Decompression happens in a background thread, which keeps up to AHEAD
+chunks of CHUNK bytes of decompressed data ready while the reader parses
+the previous ones.  zlib, bz2 and lzma release the GIL while they work, so
+the two overlap.  Compressed files can be read sequentially and seeked
+forwards (by decompressing and discarding data) from the offsets reported
+by tell(), which are offsets into the decompressed text.  Seeking
+backwards starts decompressing again from the beginning of the file.
+"""
+import bz2
+import io
+import os
+import sys
+import threading
+import zlib
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+# Bytes of compressed data to read, and of decompressed data to buffer, at
+# once
+CHUNK = 1 << 20
+# Chunks of decompressed data to keep ready ahead of the reader
+AHEAD = 8
+# Suffixes to try, in order, when a file is not found under its own name
+SUFFIXES = (".gz", ".xz", ".bz2")
+
+_MAGIC = [
+    (b"\x1f\x8b", "gzip"),
+    (b"\xfd7zXZ\x00", "xz"),
+    (b"BZh", "bz2"),
+]
+
+def find(filename):
+    """
+    Return filename if it exists, or else the name of the first compressed
+    version of it (filename plus one of SUFFIXES) which exists, or else
+    filename.
+    """
+    if os.path.exists(filename):
+        return filename
+    for suffix in SUFFIXES:
+        if os.path.exists(filename + suffix):
+            return filename + suffix
+    return filename
+
+def compression(filename):
+    """
+    Return the compression format of filename ("gzip", "xz" or "bz2"), as
+    recognised from its first bytes, or None if it is not compressed.
+    """
+    fp = open(filename, "rb")
+    start = fp.read(6)
+    fp.close()
+    for magic, kind in _MAGIC:
+        if start.startswith(magic):
+            return kind
+    return None
+
+def _decompressor(kind):
+    if kind == "gzip":
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if kind == "bz2":
+        return bz2.BZ2Decompressor()
+    if lzma is None:
+        raise ImportError("Reading .xz files requires the lzma module "
+                "(backports.lzma under Python 2)")
+    return lzma.LZMADecompressor()
+
+def _decompress(filename, kind, chunks, stop, chunk=CHUNK):
+    """
+    Decompress filename into the queue chunks, ending with an empty chunk,
+    or with the exception raised if decompression fails.  Files made by
+    concatenating compressed streams (as pigz, pbzip2 and cat do) are read
+    in full.
+    """
+    try:
+        fp = open(filename, "rb")
+        d = _decompressor(kind)
+        for data in iter(lambda: fp.read(chunk), b""):
+            while data:
+                try:
+                    out = d.decompress(data)
+                except EOFError:
+                    # A new stream starting at a chunk boundary
+                    d = _decompressor(kind)
+                    out = d.decompress(data)
+                if out:
+                    chunks.put(out)
+                if stop.is_set():
+                    fp.close()
+                    return
+                data = d.unused_data
+                if data:
+                    d = _decompressor(kind)
+        fp.close()
+        if not getattr(d, "eof", True):
+            raise EOFError("%s ended before the end of its last stream"
+                    % filename)
+        chunks.put(b"")
+    except Exception as e:
+        chunks.put(e)
+
+class DecompressedFile(io.RawIOBase):
+    """
+    Raw, read-only binary file of the decompressed contents of a compressed
+    file, decompressed in a background thread (see above).
+    """
+
+    def __init__(self, filename, kind=None, ahead=AHEAD):
+        io.RawIOBase.__init__(self)
+        self.name = filename
+        self.kind = kind or compression(filename)
+        self.ahead = ahead
+        self._thread = None
+        self._start()
+
+    def _start(self):
+        self._chunks = queue.Queue(self.ahead)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=_decompress,
+                args=(self.name, self.kind, self._chunks, self._stop))
+        self._thread.daemon = True
+        self._thread.start()
+        self._chunk = b""
+        self._offset = 0
+        self._pos = 0
+        self._done = False
+
+    def _halt(self):
+        """
+        Stop the background thread, emptying the queue so that it is not
+        left waiting to add a chunk to it.
+        """
+        if self._thread is None:
+            return
+        self._stop.set()
+        while self._thread.is_alive():
+            try:
+                self._chunks.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        self._thread = None
+
+    def _fill(self):
+        """
+        Make sure some decompressed data is ready to read, unless the end of
+        the file has been reached, and return how many bytes are ready.
+        """
+        while self._offset == len(self._chunk) and not self._done:
+            item = self._chunks.get()
+            if isinstance(item, Exception):
+                self._done = True
+                raise item
+            self._chunk = memoryview(item)
+            self._offset = 0
+            self._done = not item
+        return len(self._chunk) - self._offset
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        n = min(len(b), self._fill())
+        b[:n] = self._chunk[self._offset:self._offset + n]
+        self._offset += n
+        self._pos += n
+        return n
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, pos, whence=0):
+        """
+        Move to the given offset of the decompressed data (relative to the
+        current position if whence is 1).  Offsets relative to the end are
+        not supported, since the length is not known in advance.
+        """
+        if whence == 1:
+            pos += self._pos
+        elif whence != 0:
+            raise io.UnsupportedOperation("can only seek from the start or "
+                    "the current position of a compressed file")
+        if pos < self._pos:
+            self._halt()
+            self._start()
+        while self._pos < pos and self._fill():
+            n = min(pos - self._pos, len(self._chunk) - self._offset)
+            self._offset += n
+            self._pos += n
+        return self._pos
+
+    def close(self):
+        self._halt()
+        io.RawIOBase.close(self)
+
+def open_input(filename, mode="r", buffering=-1, encoding=None, newline=None):
+    """
+    Open filename, or a compressed version of it (see find), for reading in
+    the given mode ("r" or "rb").  Compressed files are decompressed in a
+    background thread.  In text mode, encoding and newline are as for
+    io.open under Python 3; under Python 2, text is read as bytes, as by
+    open.
+    """
+    filename = find(filename)
+    kind = compression(filename)
+    if kind is None:
+        if "b" in mode or sys.version_info[0] < 3:
+            return open(filename, mode, buffering)
+        return io.open(filename, mode, buffering, encoding=encoding,
+                newline=newline)
+    fp = io.BufferedReader(DecompressedFile(filename, kind),
+            buffering if buffering > 1 else io.DEFAULT_BUFFER_SIZE)
+    if "b" in mode or sys.version_info[0] < 3:
+        return fp
+    return io.TextIOWrapper(fp, encoding=encoding, newline=newline)
@@ -0,0 +1,86 @@
+"""
+Linking of language names between datasets via a shared key, such as an ISO
+639-3 code or a Glottocode.
+
+Each dataset is given as a dictionary mapping language names to keys.  An
+inverted index from keys to names is built once per dataset, so finding
+duplicated keys and the names which share them takes time linear in the
+number of languages.
+"""
+
+class LanguageIndex(object):
+    """
+    Inverted index from join keys to the (lower-cased) language names which
+    map to them.
+    """
+
+    def __init__(self, mapping):
+        self.mapping = mapping
+        self.names = {}
+        self.counts = {}
+        for name, key in mapping.items():
+            self.names.setdefault(key, set()).add(name.lower())
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def duplicated(self):
+        """
+        Return the set of keys which more than one language maps to.
+        """
+        return set(key for key, n in self.counts.items() if n > 1)
+
+    def names_for(self, key):
+        """
+        Return the set of lower-cased names which map to key.
+        """
+        return self.names.get(key, set())
+
+    def without(self, exclusions):
+        """
+        Return a copy of the mapping without the languages whose lower-cased
+        names are in the set exclusions.
+        """
+        return dict((name, key) for name, key in self.mapping.items()
+                if name.lower() not in exclusions)
+
+def link(a_mapping, b_mapping, missing=None):
+    """
+    Establish a duplicate-free link between two datasets, each given as a
+    dictionary mapping language names to keys.  Languages in the first
+    dataset whose key is missing are dropped.  Wherever several languages in
+    either dataset share a key, the languages in both datasets with that key
+    are compared by name: if exactly one name is used by both, that
+    language is kept and the others are dropped, otherwise all of them are.
+
+    Returns the set of lower-cased names dropped from the first dataset, the
+    filtered first mapping, the set of lower-cased names dropped from the
+    second dataset and the filtered second mapping.
+    """
+    a_index = LanguageIndex(a_mapping)
+    b_index = LanguageIndex(b_mapping)
+    a_exclusions = set(a_index.names_for(missing)) if missing else set()
+    b_exclusions = set()
+
+    # Keys which are duplicated in the first dataset constrain both
+    for key in a_index.duplicated():
+        a_names = a_index.names_for(key)
+        b_names = b_index.names_for(key)
+        true_name = a_names & b_names
+        if len(true_name) == 1:
+            # Keep the common name, kill others
+            a_exclusions |= a_names - true_name
+            b_exclusions |= b_names - true_name
+        else:
+            # Kill everything
+            a_exclusions |= a_names
+            b_exclusions |= b_names
+    # Keys which are duplicated in the second dataset only constrain it
+    for key in b_index.duplicated():
+        b_names = b_index.names_for(key)
+        true_name = a_index.names_for(key) & b_names
+        if len(true_name) == 1:
+            b_exclusions |= b_names - true_name
+        else:
+            b_exclusions |= b_names
+
+    return (a_exclusions, a_index.without(a_exclusions),
+            b_exclusions, b_index.without(b_exclusions))
@@ -0,0 +1,304 @@
+"""
+Binary encoding of CLDF data as language by feature matrices.
+
+A CLDF data file, in either the wide format (a language column followed by
+one column per feature) or the long format (Language_ID, Feature_ID and
+Value columns), is parsed once into an integer array with one row per
+language and one column per feature.  Each cell holds the index of its
+value in that feature's dictionary of values, or -1 for missing data, and
+a boolean mask marks the cells with data.  In the long format a language
+can have several values for one feature (e.g. synonyms in cognate data):
+the first is stored in the matrix and any others as a list of extra cells.
+
+The encoded matrix, restricted to the languages of an analysis and to the
+features which BEASTling keeps (those with enough data according to its
+minimum_data option, and with more than one value in those languages), is
+saved as a .npz file together with plain text lists of the languages and
+features kept and the number of states of each feature, so that inspecting
+the data or generating configs for it does not need the CSV parsing again.
+"""
+import csv
+import os
+try:
+    import ConfigParser as configparser
+except ImportError:
+    import configparser
+
+import numpy as np
+
+import cldf
+
+MISSING = ("?", "")
+
+class Matrix(object):
+    """
+    A language by feature matrix of value indices (see above), with the
+    list of values of each feature in states, and extra values of cells as
+    an array of (language, feature, value index) rows in synonyms.
+    """
+
+    def __init__(self, languages, features, values, states, synonyms=None):
+        self.languages = list(languages)
+        self.features = list(features)
+        self.states = [list(s) for s in states]
+        most = max([len(s) for s in self.states] + [0])
+        dtype = np.int16 if most <= np.iinfo(np.int16).max else np.int32
+        self.values = np.asarray(values).astype(dtype)
+        if synonyms is None:
+            synonyms = np.empty((0, 3), dtype=np.int32)
+        self.synonyms = np.asarray(synonyms, dtype=np.int32).reshape(-1, 3)
+
+    @property
+    def mask(self):
+        return self.values >= 0
+
+    def state_counts(self):
+        """
+        Return an array of the number of states of every feature.
+        """
+        return np.array([len(s) for s in self.states], dtype=int)
+
+    def coverage(self):
+        """
+        Return an array of the number of languages with data for every
+        feature.
+        """
+        return self.mask.sum(axis=0)
+
+    def value(self, language, feature):
+        """
+        Return the value of feature in language (given by name), or None if
+        it is missing.
+        """
+        f = self.features.index(feature)
+        code = self.values[self.languages.index(language), f]
+        return None if code < 0 else self.states[f][code]
+
+    def subset(self, rows, cols):
+        """
+        Return a Matrix of the languages and features with the given
+        indices.  Values which no longer occur are dropped from the states.
+        """
+        rows = np.asarray(rows, dtype=int)
+        cols = np.asarray(cols, dtype=int)
+        new_row = np.empty(len(self.languages), dtype=int)
+        new_row.fill(-1)
+        new_row[rows] = np.arange(len(rows))
+        new_col = np.empty(len(self.features), dtype=int)
+        new_col.fill(-1)
+        new_col[cols] = np.arange(len(cols))
+        synonyms = self.synonyms.copy()
+        synonyms[:, 0] = new_row[synonyms[:, 0]]
+        synonyms[:, 1] = new_col[synonyms[:, 1]]
+        synonyms = synonyms[(synonyms[:, 0] >= 0) & (synonyms[:, 1] >= 0)]
+        values = self.values[np.ix_(rows, cols)].astype(np.int32)
+        states = []
+        for j, col in enumerate(cols):
+            extra = synonyms[:, 1] == j
+            used = np.unique(np.concatenate([values[:, j][values[:, j] >= 0],
+                synonyms[extra, 2]]))
+            recode = np.empty(len(self.states[col]) + 1, dtype=np.int32)
+            recode[used] = np.arange(len(used))
+            # Index -1 (missing data) is the last entry
+            recode[-1] = -1
+            values[:, j] = recode[values[:, j]]
+            synonyms[extra, 2] = recode[synonyms[extra, 2]]
+            states.append([self.states[col][v] for v in used])
+        return Matrix([self.languages[i] for i in rows],
+                [self.features[j] for j in cols], values, states, synonyms)
+
+    def filter(self, languages=None, minimum_data=0.0, minimum_states=2):
+        """
+        Return a Matrix restricted to the given languages (in the given
+        order, ignoring any not in this matrix), if any, and then to the
+        features for which at least minimum_data percent of the languages
+        have data, as BEASTling's minimum_data option does, and which have
+        at least minimum_states values in those languages.  BEASTling
+        leaves out features with a single value, which carry no
+        information about rates.
+        """
+        if languages is None:
+            rows = np.arange(len(self.languages))
+        else:
+            index = dict((l, i) for i, l in enumerate(self.languages))
+            rows = np.array([index[l] for l in languages if l in index],
+                    dtype=int)
+        mask = self.mask[rows]
+        percent = 100.0*mask.sum(axis=0)/max(len(rows), 1)
+        cols = np.flatnonzero(percent >= minimum_data)
+        matrix = self.subset(rows, cols)
+        if minimum_states > 1:
+            keep = np.flatnonzero(matrix.state_counts() >= minimum_states)
+            if len(keep) < len(cols):
+                matrix = matrix.subset(np.arange(len(rows)), keep)
+        return matrix
+
+    def save(self, filename):
+        """
+        Save this matrix as a .npz file.  The states of all features are
+        stored in one flat array, with the offset of each feature's states.
+        """
+        counts = self.state_counts()
+        flat = [v for s in self.states for v in s]
+        np.savez_compressed(filename,
+                languages=np.array(self.languages, dtype=np.str_),
+                features=np.array(self.features, dtype=np.str_),
+                values=self.values,
+                states=np.array(flat, dtype=np.str_),
+                offsets=np.concatenate([[0], np.cumsum(counts)]),
+                synonyms=self.synonyms)
+
+    def write_lists(self, prefix):
+        """
+        Write the languages of this matrix to prefix_languages.txt, one per
+        line, and its features with their numbers of states and of languages
+        with data to prefix_features.csv.
+        """
+        fp = open(prefix + "_languages.txt", "w")
+        for language in self.languages:
+            fp.write("%s\n" % language)
+        fp.close()
+        fp = open(prefix + "_features.csv", "w")
+        writer = csv.writer(fp, lineterminator="\n")
+        writer.writerow(["feature", "states", "languages"])
+        for row in zip(self.features, self.state_counts(), self.coverage()):
+            writer.writerow(row)
+        fp.close()
+
+def load_matrix(filename):
+    """
+    Load a Matrix saved with Matrix.save.
+    """
+    data = np.load(filename)
+    offsets = data["offsets"]
+    states = data["states"].tolist()
+    matrix = Matrix(data["languages"].tolist(), data["features"].tolist(),
+            data["values"], [states[offsets[i]:offsets[i+1]]
+                for i in range(len(offsets) - 1)], data["synonyms"])
+    data.close()
+    return matrix
+
+def _code(dictionary, value):
+    """
+    Return the index of value in dictionary, adding it if it is new.
+    """
+    code = dictionary.get(value)
+    if code is None:
+        code = dictionary[value] = len(dictionary)
+    return code
+
+def _states(dictionaries):
+    """
+    Turn dictionaries from values to indices into lists of values.
+    """
+    states = []
+    for dictionary in dictionaries:
+        values = [None]*len(dictionary)
+        for value, code in dictionary.items():
+            values[code] = value
+        states.append(values)
+    return states
+
+def read_matrix(filename, block=cldf.BLOCK):
+    """
+    Read a CLDF data file in either the wide or the long format into a
+    Matrix, streaming it a block of rows at a time.  Languages and features
+    are kept in the order they first appear.
+    """
+    fp = cldf.open_csv(filename, "r")
+    reader = csv.reader(fp)
+    header = next(reader)
+    if "Feature_ID" in header:
+        matrix = _read_long(reader, header)
+    else:
+        matrix = _read_wide(reader, header, block)
+    fp.close()
+    return matrix
+
+def _read_wide(reader, header, block):
+    features = header[1:]
+    width = len(features)
+    dictionaries = [{} for f in features]
+    languages = []
+    blocks = []
+    rows = []
+    for row in reader:
+        languages.append(row[0])
+        values = row[1:] + [""]*(width + 1 - len(row))
+        rows.append([-1 if v in MISSING else _code(d, v)
+            for d, v in zip(dictionaries, values)])
+        if len(rows) == block:
+            blocks.append(np.array(rows, dtype=np.int32))
+            rows = []
+    blocks.append(np.array(rows, dtype=np.int32).reshape(-1, width))
+    return Matrix(languages, features, np.concatenate(blocks),
+            _states(dictionaries))
+
+def _read_long(reader, header):
+    lang_col = header.index("Language_ID")
+    feat_col = header.index("Feature_ID")
+    value_col = header.index("Value")
+    languages = {}
+    features = {}
+    dictionaries = []
+    cells = {}
+    synonyms = []
+    seen = set()
+    for row in reader:
+        if row[value_col] in MISSING:
+            continue
+        l = _code(languages, row[lang_col])
+        f = _code(features, row[feat_col])
+        if f == len(dictionaries):
+            dictionaries.append({})
+        v = _code(dictionaries[f], row[value_col])
+        first = cells.setdefault((l, f), v)
+        if first != v and (l, f, v) not in seen:
+            seen.add((l, f, v))
+            synonyms.append((l, f, v))
+    values = np.empty((len(languages), len(features)), dtype=np.int32)
+    values.fill(-1)
+    if cells:
+        keys = np.array(list(cells.keys()), dtype=int)
+        values[keys[:, 0], keys[:, 1]] = list(cells.values())
+    return Matrix(_states([languages])[0], _states([features])[0], values,
+            _states(dictionaries), synonyms)
+
+def _read_list(filename):
+    fp = open(filename, "r")
+    items = [line.strip() for line in fp if line.strip()]
+    fp.close()
+    return items
+
+def encode_config(config):
+    """
+    Encode the data of every model in a BEASTling config, restricted to the
+    config's languages and filtered by each model's minimum_data option.
+    The matrix for a data file such as wals_data.csv is saved, next to it,
+    as wals_data.npz, with its lists of languages and features in
+    wals_data_languages.txt and wals_data_features.csv.  Returns a
+    dictionary mapping model names to Matrices.
+    """
+    parser = configparser.RawConfigParser()
+    parser.read(config)
+    directory = os.path.dirname(os.path.abspath(config))
+    languages = None
+    if parser.has_option("languages", "languages"):
+        value = parser.get("languages", "languages")
+        path = os.path.join(directory, value)
+        languages = _read_list(path) if os.path.isfile(path) else \
+                [l.strip() for l in value.split(",")]
+    matrices = {}
+    for section in parser.sections():
+        if not section.startswith("model "):
+            continue
+        datafile = os.path.join(directory, parser.get(section, "data"))
+        minimum_data = 0.0
+        if parser.has_option(section, "minimum_data"):
+            minimum_data = parser.getfloat(section, "minimum_data")
+        matrix = read_matrix(datafile).filter(languages, minimum_data)
+        prefix = os.path.splitext(datafile)[0]
+        matrix.save(prefix + ".npz")
+        matrix.write_lists(prefix)
+        matrices[section.split(" ", 1)[1]] = matrix
+    return matrices
@@ -0,0 +1,371 @@
+#!/usr/bin/env python2
+"""
+Incremental runner for the example analyses.
+
+Every stage of the pipeline (preprocessing, BEASTling, BEAST and
+postprocessing, for each example) declares the files it reads and writes.
+A stage is skipped if the content of its inputs, its command and its
+environment hash to the same key as last time and its outputs have not been
+changed since.  The outputs of every successful run are also kept in a cache
+indexed by that key, so that going back to an earlier version of an input
+restores the matching outputs instead of rerunning, e.g., BEAST.  The cache
+stores each distinct output once, named by the hash of its contents, and
+hard-links it to and from the working tree where the file system allows, so
+that the multi-gigabyte BEAST logs and trees are not copied.  Stages
+whose inputs do not depend on each other, such as the two examples, are run
+concurrently.
+
+Run from the top of the repository, e.g.:
+
+    python examples/pipeline.py -j 2
+    python examples/pipeline.py indoeuropean.postprocess
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import threading
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+EXAMPLES = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(EXAMPLES)
+STATE_DIR = os.path.join(EXAMPLES, ".pipeline")
+STATE_FILE = os.path.join(STATE_DIR, "state.json")
+CACHE_DIR = os.path.join(STATE_DIR, "cache")
+OBJECTS_DIR = os.path.join(CACHE_DIR, "objects")
+
+BEAST_BIN = os.environ.get("BEAST_BIN", "beast/beast/bin/beast")
+BEASTLING_BIN = os.environ.get("BEASTLING_BIN", "beastling")
+
+class Stage(object):
+    """
+    A single step of the pipeline: a command run in a directory, with the
+    files (relative to the repository root) that it reads and writes.
+    """
+
+    def __init__(self, name, command, cwd, inputs, outputs, env=None):
+        self.name = name
+        self.command = command
+        self.cwd = cwd
+        self.inputs = inputs
+        self.outputs = outputs
+        self.env = env or {}
+
+    def key(self):
+        """
+        Return a hash of the command, environment and input contents of
+        this stage.
+        """
+        h = hashlib.sha1()
+        h.update(json.dumps([self.command, self.cwd, sorted(self.env.items())])
+                .encode("utf8"))
+        for filename in sorted(self.inputs):
+            h.update(filename.encode("utf8"))
+            h.update(file_hash(filename).encode("utf8"))
+        return h.hexdigest()
+
+    def run(self):
+        """
+        Run the command, raising an exception if it fails.
+        """
+        env = dict(os.environ)
+        env.update(self.env)
+        subprocess.check_call(self.command, cwd=os.path.join(ROOT, self.cwd),
+                env=env)
+
+def file_hash(filename):
+    """
+    Return the SHA-1 hash of the contents of filename (relative to the
+    repository root), or "missing" if it does not exist.
+    """
+    path = os.path.join(ROOT, filename)
+    if not os.path.exists(path):
+        return "missing"
+    h = hashlib.sha1()
+    fp = open(path, "rb")
+    for chunk in iter(lambda: fp.read(1024*1024), b""):
+        h.update(chunk)
+    fp.close()
+    return h.hexdigest()
+
+def link(source, target):
+    """
+    Hard-link source to target, replacing target if it exists, or copy
+    source if the file system (or platform) does not support hard links.
+    """
+    if os.path.exists(target):
+        os.remove(target)
+    try:
+        os.link(source, target)
+    except (AttributeError, OSError):
+        shutil.copy2(source, target)
+
+def example_stages(example, data, processed, extra, results, beast_outputs,
+        references, beast_env=None):
+    """
+    Return the preprocess, BEASTling, BEAST and postprocess stages for one
+    example analysis.  data are the raw inputs of preprocessing, processed
+    the outputs of preprocessing which BEASTling reads and extra its other
+    outputs, results the outputs of postprocessing, beast_outputs the files
+    written by BEAST and references the other files which postprocessing
+    reads, all relative to the example's directory.
+    """
+    d = "examples/" + example
+    path = lambda names: ["%s/%s" % (d, n) for n in names]
+    python = sys.executable
+    shared = ["examples/%s" % f for f in sorted(os.listdir(EXAMPLES))
+            if f.endswith(".py") and f != "pipeline.py"
+            and not f.startswith("test_")]
+    return [
+        Stage(example + ".preprocess", [python, "preprocess.py"], d,
+            path(["preprocess.py"] + data) + shared, path(processed + extra)),
+        Stage(example + ".beastling",
+            [BEASTLING_BIN, "--overwrite", example + ".conf"], d,
+            path([example + ".conf"] + processed), path([example + ".xml"])),
+        Stage(example + ".beast",
+            [BEAST_BIN, "-overwrite", "-working", "-java",
+                "%s/%s.xml" % (d, example)], ".",
+            path([example + ".xml"]), path(beast_outputs), beast_env),
+        Stage(example + ".postprocess", [python, "postprocess.py"], d,
+            path(["postprocess.py"] + beast_outputs + references) + shared,
+            path(results)),
+    ]
+
+def all_stages():
+    """
+    Return every stage of the pipeline.
+    """
+    return example_stages("austronesian",
+            ["language.csv", "iso.austronesian.txt", "a400-m1pcv-time.mcct.trees",
+                "austronesian.conf"],
+            ["wals_data.csv", "processed_austronesian_reference.nex",
+                "language_list.txt"],
+            ["supp_language_table.tex", "wals_data.npz",
+                "wals_data_languages.txt", "wals_data_features.csv"],
+            ["parameter_means.csv", "parameter_intervals.csv",
+                "rank_uncertainty.csv", "table.tex", "supp_feature_table.tex",
+                "rate_variation.eps"],
+            ["austronesian.log"],
+            ["language.csv"],
+            {"BEAST_ADDON_PATH": "./beast/packages"}) + \
+        example_stages("indoeuropean",
+            ["PIE.csv", "indoeuropean.conf"],
+            ["indoeuropean.csv"],
+            ["indoeuropean.npz", "indoeuropean_languages.txt",
+                "indoeuropean_features.csv"],
+            ["mcct.nex", "clades.txt", "parameter_means.csv",
+                "parameter_intervals.csv", "rank_uncertainty.csv", "table.tex",
+                "supp_meaning_table.tex", "category_rates.eps",
+                "starostin_correlation.txt", "swadesh_correlation.txt",
+                "pagel_correlation.txt", "mean_correlation.txt",
+                "ranking_correlations.csv"],
+            ["indoeuropean.log", "indoeuropean.nex"],
+            ["categories.csv", "Starostin-2007-110.tsv",
+                "Swadesh-1955-215.tsv", "Pagel-2007-200.tsv"])
+
+def load_state():
+    if not os.path.exists(STATE_FILE):
+        return {}
+    fp = open(STATE_FILE, "r")
+    state = json.load(fp)
+    fp.close()
+    return state
+
+def save_state(state):
+    if not os.path.exists(STATE_DIR):
+        os.makedirs(STATE_DIR)
+    fp = open(STATE_FILE, "w")
+    json.dump(state, fp, indent=1, sort_keys=True)
+    fp.close()
+
+class Runner(object):
+    """
+    Run a set of stages in dependency order, skipping those which are up to
+    date and running up to jobs independent stages at a time.
+    """
+
+    def __init__(self, stages, jobs=1, force=False, dry_run=False):
+        self.stages = stages
+        self.jobs = jobs
+        self.force = force
+        self.dry_run = dry_run
+        self.state = load_state()
+        self.lock = threading.Lock()
+        producers = {}
+        for stage in stages:
+            for output in stage.outputs:
+                producers[output] = stage.name
+        self.depends = dict((s.name, set(producers[i] for i in s.inputs
+            if i in producers)) for s in stages)
+
+    def up_to_date(self, stage, key):
+        record = self.state.get(stage.name)
+        if self.force or not record or record["key"] != key:
+            return False
+        return all(file_hash(o) == record["outputs"].get(o)
+                for o in stage.outputs)
+
+    def restore(self, stage, key):
+        """
+        Link the outputs of an earlier run with the same key back from the
+        cache, returning the hashes of their contents, or None if there is
+        no such run or its outputs are no longer intact in the cache.
+        """
+        record = os.path.join(CACHE_DIR, key + ".json")
+        if self.force or not os.path.isfile(record):
+            return None
+        fp = open(record, "r")
+        hashes = json.load(fp)
+        fp.close()
+        for output in stage.outputs:
+            cached = os.path.join(OBJECTS_DIR, hashes.get(output, "missing"))
+            if not os.path.exists(cached):
+                return None
+            if file_hash(cached) != hashes[output]:
+                # Changed in place through a hard link, so useless
+                os.remove(cached)
+                return None
+        for output in stage.outputs:
+            link(os.path.join(OBJECTS_DIR, hashes[output]),
+                    os.path.join(ROOT, output))
+        return hashes
+
+    def store(self, stage, key):
+        """
+        Add the outputs of a stage to the cache under key, returning the
+        hashes of their contents.
+        """
+        with self.lock:
+            if not os.path.exists(OBJECTS_DIR):
+                os.makedirs(OBJECTS_DIR)
+        hashes = {}
+        for output in stage.outputs:
+            hashes[output] = file_hash(output)
+            cached = os.path.join(OBJECTS_DIR, hashes[output])
+            if not os.path.exists(cached):
+                link(os.path.join(ROOT, output), cached)
+        fp = open(os.path.join(CACHE_DIR, key + ".json"), "w")
+        json.dump(hashes, fp, indent=1, sort_keys=True)
+        fp.close()
+        return hashes
+
+    def unshare(self, stage):
+        """
+        Remove any outputs of a stage which are hard-linked to the cache,
+        so that running the stage cannot overwrite the cached copies in
+        place.
+        """
+        for output in stage.outputs:
+            path = os.path.join(ROOT, output)
+            if os.path.exists(path) and os.stat(path).st_nlink > 1:
+                os.remove(path)
+
+    def execute(self, stage):
+        """
+        Bring a single stage up to date.  Returns a short description of
+        what was done.
+        """
+        key = stage.key()
+        if self.up_to_date(stage, key):
+            return "up to date"
+        if self.dry_run:
+            return "would run"
+        hashes = self.restore(stage, key)
+        if hashes is not None:
+            action = "restored from cache"
+        else:
+            self.unshare(stage)
+            stage.run()
+            hashes = self.store(stage, key)
+            action = "ran"
+        with self.lock:
+            self.state[stage.name] = {"key": key, "outputs": hashes}
+            save_state(self.state)
+        return action
+
+    def _worker(self, stage, done):
+        try:
+            done.put((stage, self.execute(stage), None))
+        except Exception as e:
+            done.put((stage, None, e))
+
+    def run(self):
+        """
+        Run every stage once all the stages it depends on have finished.
+        Returns True if every stage succeeded.  Stages which depend on
+        each other in a cycle can never run, and fail.
+        """
+        waiting = list(self.stages)
+        finished = set()
+        failed = set()
+        running = 0
+        done = queue.Queue()
+        while waiting or running:
+            for stage in list(waiting):
+                if running >= self.jobs:
+                    break
+                if self.depends[stage.name] & failed:
+                    waiting.remove(stage)
+                    failed.add(stage.name)
+                    print("%s: skipped, a dependency failed" % stage.name)
+                elif self.depends[stage.name] <= finished:
+                    waiting.remove(stage)
+                    running += 1
+                    thread = threading.Thread(target=self._worker,
+                            args=(stage, done))
+                    thread.daemon = True
+                    thread.start()
+            if not running:
+                for stage in waiting:
+                    failed.add(stage.name)
+                    print("%s: failed, its dependencies form a cycle"
+                            % stage.name)
+                break
+            stage, action, error = done.get()
+            running -= 1
+            if error:
+                failed.add(stage.name)
+                print("%s: failed (%s)" % (stage.name, error))
+            else:
+                finished.add(stage.name)
+                print("%s: %s" % (stage.name, action))
+        return not failed
+
+def main():
+    parser = argparse.ArgumentParser(
+            description="Incrementally rebuild the example analyses.")
+    parser.add_argument("targets", nargs="*",
+            help="Stages to bring up to date, e.g. austronesian or "
+            "indoeuropean.postprocess (default everything).  The stages they "
+            "depend on are included automatically.")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+            help="Number of stages to run at once")
+    parser.add_argument("-f", "--force", action="store_true",
+            help="Rerun stages even if they are up to date")
+    parser.add_argument("-n", "--dry-run", action="store_true",
+            help="Only report which stages would run")
+    args = parser.parse_args()
+
+    stages = all_stages()
+    if args.targets:
+        runner = Runner(stages)
+        wanted = set()
+        todo = [s.name for s in stages if any(s.name == t or
+            s.name.startswith(t + ".") for t in args.targets)]
+        while todo:
+            name = todo.pop()
+            if name not in wanted:
+                wanted.add(name)
+                todo.extend(runner.depends[name])
+        stages = [s for s in stages if s.name in wanted]
+    runner = Runner(stages, args.jobs, args.force, args.dry_run)
+    sys.exit(0 if runner.run() else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""
+Comparison of rankings of meaning classes (or any other keys) against
+reference rankings from the literature.
+
+Each reference ranking is indexed once, as a dictionary from keys to
+positions.  Rankings are then aligned on the keys they share with our own
+ranking into rows of a position array, with missing keys masked out, so that
+Spearman's rho and Kendall's tau against any number of references, and for
+any number of bootstrap replicates of our ranking, are computed with array
+operations in a single call.
+"""
+import numpy as np
+
+# Number of replicates to compare all pairs of keys for at once in kendall
+KENDALL_BLOCK = 50
+# Number of resampling counts to hold in memory at once in bootstrap_means
+BOOTSTRAP_BUFFER = 4*1024*1024
+
+class Ranking(object):
+    """
+    An ordered list of keys, from first to last, indexed by position.  If a
+    key occurs more than once, its first position is used.
+    """
+
+    def __init__(self, keys):
+        self.keys = []
+        self.index = {}
+        for key in keys:
+            if key not in self.index:
+                self.index[key] = len(self.keys)
+                self.keys.append(key)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return key in self.index
+
+def mean_ranking(rankings, keys=None):
+    """
+    Return the mean position of every key shared by all the given Rankings
+    (and by keys, if given), as a dictionary, with positions counted among
+    the shared keys only.
+    """
+    shared = set(rankings[0].index) if keys is None else set(keys)
+    for ranking in rankings:
+        shared &= set(ranking.index)
+    total = dict((key, 0.0) for key in shared)
+    for ranking in rankings:
+        for position, key in enumerate(k for k in ranking.keys if k in shared):
+            total[key] += position
+    return dict((key, value/len(rankings)) for key, value in total.items())
+
+def align(keys, references):
+    """
+    Align reference rankings on keys, the keys of our own ranking.  Each
+    reference is either a Ranking or a dictionary mapping keys to scores.
+    Returns an array with one row per reference and one column per key,
+    holding the position (or score) of each key in each reference, with nan
+    for keys the reference does not have.
+    """
+    positions = np.empty((len(references), len(keys)))
+    positions.fill(np.nan)
+    for row, reference in enumerate(references):
+        index = reference.index if isinstance(reference, Ranking) else reference
+        for col, key in enumerate(keys):
+            position = index.get(key)
+            if position is not None:
+                positions[row, col] = position
+    return positions
+
+def rank(values):
+    """
+    Return the ranks (from 1) of values along the last axis, with tied
+    values getting the average of their ranks and nan values ignored (and
+    given a rank of nan).
+    """
+    values = np.asarray(values, dtype=float)
+    flat = values.reshape(-1, values.shape[-1])
+    rows, n = flat.shape
+    # nan sorts last, so the ranks of the other values are unaffected by it
+    order = np.argsort(flat, axis=1, kind="mergesort")
+    ordered = flat[np.arange(rows)[:, None], order]
+    starts = np.ones(flat.shape, dtype=bool)
+    starts[:, 1:] = ordered[:, 1:] != ordered[:, :-1]
+    groups = np.cumsum(starts.ravel()) - 1
+    ordinal = np.tile(np.arange(1, n + 1, dtype=float), rows)
+    average = np.bincount(groups, ordinal)/np.bincount(groups)
+    ranks = np.empty(flat.shape)
+    ranks[np.arange(rows)[:, None], order] = average[groups].reshape(flat.shape)
+    ranks[np.isnan(flat)] = np.nan
+    return ranks.reshape(values.shape)
+
+def _pairs(values, references):
+    """
+    Broadcast values (one row per replicate of our ranking, or a single row)
+    against references (one row per reference), hiding the values of keys
+    that each reference does not have.
+    """
+    values = np.atleast_2d(np.asarray(values, dtype=float))
+    references = np.atleast_2d(references)
+    x = np.where(np.isnan(references)[None, :, :], np.nan, values[:, None, :])
+    y = np.broadcast_to(references[None, :, :], x.shape)
+    return x, y
+
+def _result(corr, values):
+    """
+    Drop the replicate axis of an array of correlations if values was a
+    single ranking.
+    """
+    return corr[0] if np.ndim(values) == 1 else corr
+
+def spearman(values, references):
+    """
+    Return Spearman's rank correlation between values and each row of the
+    aligned references (see align), using only the keys each reference has.
+    values is either one value per key (e.g. posterior means, or positions
+    in our ranking), giving one correlation per reference, or a 2D array
+    with one row per replicate, giving an array of correlations with one row
+    per replicate and one column per reference.
+    """
+    x, y = _pairs(values, references)
+    x, y = rank(x), rank(y)
+    x = x - np.nanmean(x, axis=-1)[..., None]
+    y = y - np.nanmean(y, axis=-1)[..., None]
+    corr = np.nansum(x*y, axis=-1)/np.sqrt(
+            np.nansum(x*x, axis=-1)*np.nansum(y*y, axis=-1))
+    return _result(corr, values)
+
+def kendall(values, references):
+    """
+    Return Kendall's rank correlation (tau-b, which allows for ties) between
+    values and each row of the aligned references, in the same way as
+    spearman.  All pairs of keys are compared at once, for KENDALL_BLOCK
+    replicates at a time to bound memory use.
+    """
+    x, y = _pairs(values, references)
+    # Signs of all pairwise differences, with pairs involving a key missing
+    # from the reference counting as neither concordant, discordant nor tied
+    sy = np.nan_to_num(np.sign(y[0, :, :, None] - y[0, :, None, :]))
+    valid = ~(np.isnan(y[0, :, :, None]) | np.isnan(y[0, :, None, :]))
+    ties_y = np.abs(sy).sum(axis=(-2, -1))
+    corr = np.empty(x.shape[:2])
+    for start in range(0, len(x), KENDALL_BLOCK):
+        block = x[start:start+KENDALL_BLOCK]
+        sx = np.sign(block[..., :, None] - block[..., None, :])
+        sx = np.where(valid, np.nan_to_num(sx), 0)
+        corr[start:start+KENDALL_BLOCK] = (sx*sy).sum(axis=(-2, -1))/np.sqrt(
+                np.abs(sx).sum(axis=(-2, -1))*ties_y)
+    return _result(corr, values)
+
+def bootstrap_means(samples, replicates=1000, seed=None):
+    """
+    Return the column means of replicates bootstrap resamples of the rows
+    of samples (one row per posterior sample, one column per key).  Each
+    resample is drawn as a vector of counts of every row, so that the means
+    of a block of resamples are computed with a single matrix product.
+    Blocks hold at most BOOTSTRAP_BUFFER counts, so memory use does not grow
+    with the number of replicates.
+    """
+    samples = np.asarray(samples, dtype=float)
+    n = len(samples)
+    rng = np.random.RandomState(seed)
+    block = max(1, BOOTSTRAP_BUFFER // max(n, 1))
+    means = np.empty((replicates, samples.shape[1]))
+    for start in range(0, replicates, block):
+        size = min(block, replicates - start)
+        counts = rng.multinomial(n, np.ones(n)/n, size=size)
+        means[start:start+size] = counts.dot(samples)/float(n)
+    return means
+
+def bootstrap(samples, references, replicates=1000, method=spearman,
+        seed=None):
+    """
+    Return an array of the correlations between our ranking and each of
+    the aligned references for each of replicates bootstrap resamples of the
+    posterior samples, with one row per replicate and one column per
+    reference.
+    """
+    return method(bootstrap_means(samples, replicates, seed), references)
@@ -0,0 +1,151 @@
+"""
+Registry of published rankings of meaning classes by stability.
+
+Each reference ranking is a TSV file with a gloss column and a score column,
+and needs its own normalisation of glosses (lower-casing, dropping a "to "
+prefix or a parenthesised comment, and so on) to match the meaning classes
+of our analyses.  The normalisation steps are registered by name in
+NORMALISERS, and each reference in REFERENCES lists the steps it uses.
+
+A reference is parsed at most once per process.  The parsed ranking is also
+saved in a cache directory, under a hash of the file's contents and of how
+it is parsed, so that later processes (such as batch jobs comparing many
+analyses against the same references) do not parse it again.
+"""
+import csv
+import hashlib
+import json
+import os
+
+import inputs
+import rankings
+
+EXAMPLES = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.path.join(EXAMPLES, ".cache", "references")
+# Change this whenever parsing or normalisation changes, to invalidate the
+# rankings cached on disk
+VERSION = 1
+
+def _parenthesis(gloss):
+    return gloss.split("(")[0].strip() if "(" in gloss else gloss
+
+NORMALISERS = {
+    "lower": lambda gloss: gloss.lower(),
+    # Swadesh marks the meanings of his 100 word list with an asterisk
+    "asterisk": lambda gloss: gloss[1:] if gloss.startswith("*") else gloss,
+    "parenthesis": _parenthesis,
+    "infinitive": lambda gloss: gloss.split(" ", 1)[1]
+        if gloss.startswith("to ") else gloss,
+    "verb": lambda gloss: gloss[:-4] if gloss.endswith(" (v)") else gloss,
+    "walk(go)": lambda gloss: "walk" if gloss == "walk(go)" else gloss,
+}
+
+def normalise(gloss, steps):
+    """
+    Apply the named normalisation steps to gloss, in order.
+    """
+    for step in steps:
+        gloss = NORMALISERS[step](gloss)
+    return gloss
+
+class Reference(object):
+    """
+    A ranking of meaning classes stored in the TSV file filename, ordered by
+    the score column (as parsed by the function score_type), from the most
+    to the least stable.
+    """
+
+    def __init__(self, filename, gloss, score, steps, score_type=int,
+            descending=False):
+        self.filename = filename
+        self.gloss = gloss
+        self.score = score
+        self.steps = steps
+        self.score_type = score_type
+        self.descending = descending
+
+    def key(self, path):
+        """
+        Return a hash of the contents of the file at path and of how it is
+        parsed.
+        """
+        h = hashlib.sha1()
+        h.update(json.dumps([VERSION, self.gloss, self.score, list(self.steps),
+            self.score_type.__name__, self.descending]).encode("utf8"))
+        fp = open(path, "rb")
+        h.update(fp.read())
+        fp.close()
+        return h.hexdigest()
+
+    def parse(self, path):
+        """
+        Read the file at path, which may be compressed (see inputs), and
+        return its normalised glosses in order.
+        """
+        ranking = []
+        fp = inputs.open_input(path, "r")
+        for row in csv.DictReader(fp, delimiter="\t"):
+            word = normalise(row[self.gloss], self.steps)
+            ranking.append((self.score_type(row[self.score]), word))
+        fp.close()
+        ranking.sort()
+        if self.descending:
+            ranking.reverse()
+        return [w for (n, w) in ranking]
+
+REFERENCES = {
+    "starostin": Reference("Starostin-2007-110.tsv", "GLOSS", "NUMBER",
+        ("lower", "walk(go)")),
+    "swadesh": Reference("Swadesh-1955-215.tsv", "ENGLISH", "STABILITY_SCORE",
+        ("lower", "asterisk", "parenthesis"), descending=True),
+    "pagel": Reference("Pagel-2007-200.tsv", "ENGLISH", "MEAN_RATE",
+        ("lower", "parenthesis", "infinitive"), score_type=float),
+}
+
+# Rankings already loaded by this process, by path, size and mtime
+_loaded = {}
+
+def register(name, reference):
+    """
+    Add a Reference to the registry under name.
+    """
+    REFERENCES[name] = reference
+
+def load(name, directory="."):
+    """
+    Return the registered reference ranking name, read from directory, as a
+    rankings.Ranking.  The file may also be compressed (see inputs).
+    """
+    reference = REFERENCES[name]
+    path = inputs.find(os.path.abspath(os.path.join(directory,
+        reference.filename)))
+    stat = os.stat(path)
+    memo = (name, path, stat.st_size, stat.st_mtime)
+    if memo in _loaded:
+        return _loaded[memo]
+    cached = os.path.join(CACHE_DIR, "%s-%s.json" % (name, reference.key(path)))
+    if os.path.exists(cached):
+        fp = open(cached, "r")
+        glosses = json.load(fp)
+        fp.close()
+    else:
+        glosses = reference.parse(path)
+        if not os.path.exists(CACHE_DIR):
+            os.makedirs(CACHE_DIR)
+        # Write under a temporary name first, so that concurrent jobs never
+        # see a partly written file
+        tmp = "%s.%d" % (cached, os.getpid())
+        fp = open(tmp, "w")
+        json.dump(glosses, fp)
+        fp.close()
+        os.rename(tmp, cached)
+    ranking = rankings.Ranking(glosses)
+    _loaded[memo] = ranking
+    return ranking
+
+def gloss_index(name, directory="."):
+    """
+    Return a dictionary mapping the normalised glosses of the registered
+    reference ranking name to their positions in it, from 0.
+    """
+    return load(name, directory).index
@@ -0,0 +1,154 @@
+"""
+Results of an analysis shared between the stages of postprocessing.
+
+The posterior means of the featureClockRate parameters are computed once and
+held, ranked from slowest to fastest, in an AnalysisResults object together
+with the feature IDs, display names and categories of the features.  Every
+table, figure and correlation is made from this object, and
+parameter_means.csv is only written as an export (or read back when a
+stage is run on its own, without computing the means first).  The full
+posterior distribution of every rate is summarised as a histogram while
+the means are computed, giving credible intervals (saved to
+parameter_intervals.csv) with memory use set by the number of bins rather
+than the length of the chain.
+"""
+import csv
+
+import numpy as np
+
+import traces
+import utils
+
+class AnalysisResults(object):
+    """
+    Posterior mean rates of the features of an analysis, ranked from
+    slowest (rank 1) to fastest.  All attributes are in rank order:
+    parameters are the names of the parameters in the BEAST log, ids the
+    feature IDs (the last part of the parameter names), names the names to
+    show in tables and figures, categories the categories of the features
+    (or None), category_order the order in which to show the categories,
+    means the posterior means and ranks the ranks.  The
+    parameters and means given are ranked here, unless ranked is True.
+
+    The means are scaled as in the published parameter_means.csv (see
+    utils.total_means).  If the results come from a log, distributions is
+    the traces.HistogramSummary of the posterior distributions of the rates
+    (with columns in the order of the log), posterior_mean the plain mean of
+    the post-burnin samples of each rate, and lower, median and upper the
+    bounds of the 95% credible interval and the median of each rate.
+    Otherwise these are None.
+    """
+
+    def __init__(self, parameters, means, ranked=False):
+        if ranked:
+            ranked = list(zip([float(m) for m in means], parameters))
+        else:
+            ranked = utils.rank_means(parameters, means)
+        self.parameters = [key for mean, key in ranked]
+        self.ids = [key.split(":")[-1] for key in self.parameters]
+        self.names = list(self.ids)
+        self.categories = [None]*len(self.ids)
+        self.category_order = []
+        self.means = np.array([mean for mean, key in ranked])
+        self.ranks = np.arange(1, len(ranked) + 1)
+        self.distributions = None
+        self.posterior_mean = self.lower = self.median = self.upper = None
+
+    def __len__(self):
+        return len(self.parameters)
+
+    def ranked(self):
+        """
+        Return a list of (mean, parameter) pairs in rank order, as returned
+        by utils.write_means.
+        """
+        return list(zip(self.means.tolist(), self.parameters))
+
+    def set_names(self, func):
+        """
+        Set the display name of every feature to func(feature ID).
+        """
+        self.names = [func(i) for i in self.ids]
+
+    def set_categories(self, func, order=None):
+        """
+        Set the category of every feature to func(feature ID), and the order
+        of the categories to order (by default, sorted).
+        """
+        self.categories = [func(i) for i in self.ids]
+        self.category_order = list(order) if order is not None else \
+                sorted(set(c for c in self.categories if c is not None))
+
+    def set_distributions(self, summary):
+        """
+        Set the posterior distributions of the rates from a
+        traces.HistogramSummary of the same parameters.
+        """
+        self.distributions = summary
+        column = dict((name, i) for i, name in enumerate(summary.names))
+        order = [column[p] for p in self.parameters]
+        self.posterior_mean = summary.mean[order]
+        self.lower, self.median, self.upper = \
+                summary.quantiles([0.025, 0.5, 0.975])[:, order]
+
+    def export_intervals(self, outfile):
+        """
+        Save the posterior means, medians and 95% credible intervals of the
+        rates to outfile as CSV, in rank order.  All four columns summarise
+        the post-burnin samples alone, so the means are posterior_mean, not
+        the scaled means of parameter_means.csv.
+        """
+        fp = open(outfile, "w")
+        fp.write("parameter,mean,lower,median,upper\n")
+        for row in zip(self.parameters, self.posterior_mean, self.lower,
+                self.median, self.upper):
+            fp.write("%s,%f,%f,%f,%f\n" % row)
+        fp.close()
+
+    def export(self, outfile):
+        """
+        Save the ranked means to outfile in the format of
+        parameter_means.csv.
+        """
+        utils.save_means(self.ranked(), outfile)
+
+def load_categories(filename, concept="concept", category="category"):
+    """
+    Read a table of concepts (or other feature IDs) and their categories,
+    such as a Concepticon-style concept list, from the CSV file filename.
+    Returns a dictionary mapping concepts to categories, with None for
+    concepts with an empty category (which are left out of comparisons
+    between categories), and the list of categories in the order they first
+    appear.
+    """
+    fp = open(filename, "r")
+    mapping = {}
+    order = []
+    for row in csv.DictReader(fp):
+        value = row[category].strip() or None
+        mapping[row[concept].strip()] = value
+        if value is not None and value not in order:
+            order.append(value)
+    fp.close()
+    return mapping, order
+
+def from_log(logfile, burnin=0.1, cache=False):
+    """
+    Return the AnalysisResults of the featureClockRate parameters in
+    logfile, discarding burnin samples (see utils.write_means), with their
+    posterior distributions summarised as histograms in the same pass.  The
+    means are those of utils.total_means.
+    """
+    summary = utils.summarise_means(logfile, burnin, cache,
+            summary=traces.HistogramSummary)
+    analysis = AnalysisResults(summary.names, utils.total_means(summary))
+    analysis.set_distributions(summary)
+    return analysis
+
+def load(infile):
+    """
+    Return the AnalysisResults saved to infile by AnalysisResults.export.
+    """
+    ranked = utils.read_means(infile)
+    return AnalysisResults([key for mean, key in ranked],
+            [mean for mean, key in ranked], ranked=True)
@@ -0,0 +1,294 @@
+#!/usr/bin/env python2
+"""
+Run a grid of variants of a BEASTling analysis in parallel on one machine.
+
+Every combination of the option values given with --grid becomes a separate
+analysis, with its own BEASTling config, XML file and logs in its own
+directory under the runs directory.  BEAST processes are launched as long as
+the core budget allows, their progress is followed from the Sample column of
+their logs, failed runs are retried, and each run is postprocessed (ranked
+posterior means written to parameter_means.csv in its directory, plus an
+optional command of your own) as soon as it finishes.
+
+Run from the top of the repository, e.g.:
+
+    python examples/scheduler.py examples/austronesian/austronesian.conf \\
+        --grid "model mk.minimum_data=25,50,75" \\
+        --grid "model mk.rate_variation=True,False" --cores 4
+
+To try it out without BEAST or BEASTling, use the fake executable:
+
+    python examples/scheduler.py examples/austronesian/austronesian.conf \\
+        --grid "model mk.minimum_data=25,50" \\
+        --beast "python examples/fakebeast.py --seconds 5" \\
+        --beastling "python examples/fakebeast.py"
+"""
+import argparse
+import itertools
+import os
+import shlex
+import subprocess
+import sys
+import time
+try:
+    import ConfigParser as configparser
+except ImportError:
+    import configparser
+
+import pipeline
+import traces
+import utils
+
+class Run(object):
+    """
+    A single variant of an analysis, and the state of its BEAST process.
+    """
+
+    def __init__(self, name, directory, overrides):
+        self.name = name
+        self.directory = directory
+        self.overrides = overrides
+        self.config = os.path.join(directory, name + ".conf")
+        self.xml = os.path.join(directory, name + ".xml")
+        self.logfile = os.path.join(directory, name + ".log")
+        self.chainlength = None
+        self.process = None
+        self.output = None
+        self.attempts = 0
+        self.status = "pending"
+
+    def progress(self):
+        """
+        Return the fraction of the chain logged so far, for progress
+        reports.  The last sample is logged at the last multiple of the
+        logging interval, so this can stay short of 1 for a finished chain.
+        """
+        state = traces.last_state(self.logfile)
+        if state is None or not self.chainlength:
+            return 0.0
+        return min(1.0, float(state)/self.chainlength)
+
+def parse_grid(specs):
+    """
+    Parse option grid specifications of the form "section.option=a,b,c"
+    into a list of ((section, option), values) pairs.
+    """
+    grid = []
+    for spec in specs:
+        key, values = spec.split("=", 1)
+        section, option = key.rsplit(".", 1)
+        grid.append(((section, option), values.split(",")))
+    return grid
+
+def variant_name(basename, overrides):
+    """
+    Return a name for the variant of basename with the given list of
+    ((section, option), value) overrides, e.g.
+    austronesian_minimum_data-25_rate_variation-True.
+    """
+    return "_".join([basename] + ["%s-%s" % (option, value)
+        for (section, option), value in overrides])
+
+def expand_grid(config, grid, runs_dir):
+    """
+    Write one BEASTling config to its own directory under runs_dir for every
+    combination of values in grid, and return a list of Runs.  File names in
+    the original config are made absolute, so that the variants can find
+    their data wherever they are run.
+    """
+    base = configparser.RawConfigParser()
+    base.read(config)
+    basename = base.get("admin", "basename")
+    config_dir = os.path.dirname(os.path.abspath(config))
+    runs = []
+    combinations = itertools.product(*[[(key, value) for value in values]
+        for key, values in grid])
+    for overrides in combinations:
+        name = variant_name(basename, overrides)
+        directory = os.path.abspath(os.path.join(runs_dir, name))
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        parser = configparser.RawConfigParser()
+        parser.read(config)
+        for section in parser.sections():
+            for option, value in parser.items(section):
+                path = os.path.join(config_dir, value)
+                if value and os.path.isfile(path):
+                    parser.set(section, option, path)
+        for (section, option), value in overrides:
+            if not parser.has_section(section):
+                parser.add_section(section)
+            parser.set(section, option, value)
+        parser.set("admin", "basename", name)
+        run = Run(name, directory, overrides)
+        run.chainlength = parser.getint("MCMC", "chainlength")
+        fp = open(run.config, "w")
+        parser.write(fp)
+        fp.close()
+        runs.append(run)
+    return runs
+
+class Scheduler(object):
+    """
+    Run BEAST on a list of Runs, using at most cores cores at a time and
+    threads cores per run, retrying each failed run up to retries times.
+    """
+
+    def __init__(self, runs, beast, beastling, cores=1, threads=1, retries=2,
+            postprocess=None, interval=10):
+        self.runs = runs
+        self.beast = _command(beast)
+        self.beastling = _command(beastling)
+        self.cores = cores
+        self.threads = threads
+        self.retries = retries
+        self.postprocess = postprocess
+        self.interval = interval
+        self.env = dict(os.environ)
+        addons = os.path.join(pipeline.ROOT, "beast", "packages")
+        if "BEAST_ADDON_PATH" not in self.env and os.path.isdir(addons):
+            self.env["BEAST_ADDON_PATH"] = addons
+
+    def prepare(self, run):
+        """
+        Run BEASTling on the config of run to produce its XML file.
+        """
+        subprocess.check_call(self.beastling + ["--overwrite",
+            os.path.basename(run.config)], cwd=run.directory)
+
+    def launch(self, run):
+        """
+        Start BEAST on run, sending its output to a file in its directory.
+        """
+        run.attempts += 1
+        run.status = "running"
+        run.output = open(os.path.join(run.directory, "beast.out"), "w")
+        command = self.beast + ["-overwrite", "-working", "-java"]
+        if self.threads > 1:
+            command += ["-threads", str(self.threads)]
+        run.process = subprocess.Popen(command + [run.xml], cwd=run.directory,
+                stdout=run.output, stderr=subprocess.STDOUT, env=self.env)
+        print("%s: started (attempt %d)" % (run.name, run.attempts))
+
+    def finish(self, run):
+        """
+        Postprocess a run whose chain has completed: write its ranked
+        posterior means to parameter_means.csv in its directory and run the
+        postprocess command, if any.  The stages of the examples'
+        postprocess.py scripts are not run here, since their tables and
+        figures need the inputs of the published analyses; pass such a
+        script as the postprocess command to run it.
+        """
+        utils.write_means(run.logfile,
+                os.path.join(run.directory, "parameter_means.csv"))
+        if self.postprocess:
+            subprocess.check_call(self.postprocess, shell=True,
+                    cwd=run.directory, env=dict(self.env, RUN_NAME=run.name,
+                        RUN_LOG=run.logfile))
+        run.status = "done"
+        print("%s: done" % run.name)
+
+    def check(self, run):
+        """
+        Check on a running BEAST process, retrying or postprocessing it if
+        it has exited.  BEAST exits with code 0 only once the chain is
+        complete, so that is taken as success.
+        """
+        code = run.process.poll()
+        if code is None:
+            return
+        run.output.close()
+        run.process = None
+        if code == 0:
+            try:
+                self.finish(run)
+            except (subprocess.CalledProcessError, ValueError, IOError) as e:
+                run.status = "failed"
+                print("%s: postprocessing failed (%s)" % (run.name, e))
+        elif run.attempts <= self.retries:
+            run.status = "pending"
+            print("%s: BEAST exited with code %d, retrying" % (run.name, code))
+        else:
+            run.status = "failed"
+            print("%s: BEAST exited with code %d, giving up after %d attempts"
+                    % (run.name, code, run.attempts))
+
+    def report(self):
+        for run in self.runs:
+            if run.status == "running":
+                print("%s: %5.1f%%" % (run.name, 100*run.progress()))
+
+    def run(self):
+        """
+        Prepare and run every Run, returning True if all of them succeeded.
+        """
+        for run in self.runs:
+            try:
+                self.prepare(run)
+            except (subprocess.CalledProcessError, OSError) as e:
+                run.status = "failed"
+                print("%s: BEASTling failed (%s)" % (run.name, e))
+        slots = max(1, self.cores // self.threads)
+        last_report = time.time()
+        while any(r.status in ("pending", "running") for r in self.runs):
+            for run in self.runs:
+                if run.status == "running":
+                    self.check(run)
+            running = sum(1 for r in self.runs if r.status == "running")
+            for run in self.runs:
+                if running >= slots:
+                    break
+                if run.status == "pending":
+                    self.launch(run)
+                    running += 1
+            if time.time() - last_report >= self.interval:
+                self.report()
+                last_report = time.time()
+            time.sleep(min(1.0, self.interval))
+        return all(r.status == "done" for r in self.runs)
+
+def _command(command):
+    """
+    Split a command line into a list, making a relative path to the
+    executable absolute if it exists relative to the repository root, since
+    runs are executed in their own directories.
+    """
+    command = shlex.split(command)
+    path = os.path.join(pipeline.ROOT, command[0])
+    if not os.path.isabs(command[0]) and os.path.exists(path):
+        command[0] = path
+    return [os.path.abspath(c) if c.endswith(".py") and os.path.exists(c)
+            else c for c in command]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("config", help="BEASTling config to make variants of")
+    parser.add_argument("-g", "--grid", action="append", default=[],
+            metavar="SECTION.OPTION=VALUES", help="Comma-separated values of "
+            "one config option, e.g. \"model mk.minimum_data=25,50\"")
+    parser.add_argument("-d", "--runs-dir", default="runs",
+            help="Directory to create one subdirectory per run in")
+    parser.add_argument("-c", "--cores", type=int, default=1,
+            help="Number of cores to use at once")
+    parser.add_argument("-t", "--threads", type=int, default=1,
+            help="Number of threads for each BEAST process")
+    parser.add_argument("-r", "--retries", type=int, default=2,
+            help="Number of times to retry a failed run")
+    parser.add_argument("--beast", default=pipeline.BEAST_BIN,
+            help="BEAST command")
+    parser.add_argument("--beastling", default=pipeline.BEASTLING_BIN,
+            help="BEASTling command")
+    parser.add_argument("-p", "--postprocess", help="Shell command to run in "
+            "each run's directory once it finishes, with the run's name and "
+            "log file in $RUN_NAME and $RUN_LOG")
+    parser.add_argument("-i", "--interval", type=float, default=60,
+            help="Seconds between progress reports")
+    args = parser.parse_args()
+
+    runs = expand_grid(args.config, parse_grid(args.grid), args.runs_dir)
+    scheduler = Scheduler(runs, args.beast, args.beastling, args.cores,
+            args.threads, args.retries, args.postprocess, args.interval)
+    sys.exit(0 if scheduler.run() else 1)
+
+if __name__ == "__main__":
+    main()
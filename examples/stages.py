@@ -0,0 +1,208 @@
+"""
+Command lines for scripts made of stages which can be run separately.
+
+A script, such as one of the postprocessing scripts, declares its stages as
+a list of (name, function, message) triples in the order they are run, and
+any of them can be named on the command line to run just those, e.g.
+
+    python postprocess.py means correlations
+
+or chosen with --only and --skip.  The wall time, CPU time (including that
+of child processes) and peak memory use of every stage run are recorded
+and saved as a JSON report, along with the sizes of the script's inputs,
+so that runs on data of different sizes or with different versions of the
+scripts can be compared.  With --profile, each stage is also run under
+cProfile and its statistics saved to profile_<stage>.prof.
+
+Stage functions import their heavy dependencies (pandas, matplotlib,
+seaborn, ete2) themselves, so that stages which do not need them do not
+pay for them at startup.  The --check-imports option imports the script in
+a fresh interpreter and fails if this takes more than IMPORT_BUDGET seconds
+or loads any of the HEAVY modules.
+"""
+import argparse
+import cProfile
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+import inputs
+
+# Modules which only the stages that need them should import
+HEAVY = ("pandas", "matplotlib", "seaborn", "scipy", "ete2", "PyQt4")
+# Seconds allowed for importing a script and the modules all of its stages
+# share
+IMPORT_BUDGET = 1.0
+
+_PROBE = """
+import sys
+import time
+start = time.time()
+import %s
+print(time.time() - start)
+print(" ".join(sorted(m for m in sys.modules if m.split(".")[0] in %r)))
+"""
+
+def parser(stages, description):
+    """
+    Return an argparse parser for a script with the given stages, to which
+    the script can add options of its own.
+    """
+    names = [name for name, func, message in stages]
+    p = argparse.ArgumentParser(description=description)
+    p.add_argument("stages", nargs="*", metavar="STAGE",
+            help="Stages to run, out of %s (default all)" % ", ".join(names))
+    p.add_argument("--only", nargs="+", default=[], metavar="STAGE",
+            help="Stages to run, as an option")
+    p.add_argument("--skip", nargs="+", default=[], metavar="STAGE",
+            help="Stages not to run")
+    p.add_argument("--profile", action="store_true",
+            help="Save cProfile statistics of each stage to "
+            "profile_<stage>.prof")
+    p.add_argument("--report", default="timings.json",
+            help="File to save the timings of the stages to")
+    p.add_argument("--check-imports", action="store_true",
+            help="Only check that importing this script is fast and does "
+            "not load %s" % ", ".join(HEAVY))
+    return p
+
+def import_time(script):
+    """
+    Import script in a fresh interpreter, in its own directory, and return
+    the time this took and the list of HEAVY modules it loaded.
+    """
+    directory, filename = os.path.split(os.path.abspath(script))
+    module = os.path.splitext(filename)[0]
+    output = subprocess.check_output([sys.executable, "-c",
+        _PROBE % (module, HEAVY)], cwd=directory).decode("utf8").split("\n")
+    return float(output[0]), output[1].split()
+
+def check_imports(script):
+    """
+    Report the import time of script and the HEAVY modules it loads, and
+    return True if it is within budget and loads none.
+    """
+    seconds, heavy = import_time(script)
+    print("Importing %s took %.3f seconds (budget %.3f)" % (
+        os.path.basename(script), seconds, IMPORT_BUDGET))
+    if heavy:
+        print("Heavy modules loaded at import time: %s" % ", ".join(heavy))
+    return seconds <= IMPORT_BUDGET and not heavy
+
+def reset_peak_rss():
+    """
+    Reset the peak resident set size of this process to its current size,
+    so that the peak of a single stage can be measured, and return True, or
+    return False if this is not supported (it is only possible on Linux).
+    """
+    try:
+        fp = open("/proc/self/clear_refs", "w")
+        fp.write("5")
+        fp.close()
+    except (IOError, OSError):
+        return False
+    return True
+
+def peak_rss():
+    """
+    Return the peak resident set size of this process, in kilobytes, since
+    it started or since reset_peak_rss was last called.
+    """
+    try:
+        fp = open("/proc/self/status", "r")
+        for line in fp:
+            if line.startswith("VmHWM:"):
+                fp.close()
+                return int(line.split()[1])
+        fp.close()
+    except (IOError, OSError):
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+def run_stage(name, func, args, profile=False):
+    """
+    Call func(args), and return a dictionary of the wall time, CPU time and
+    peak RSS of the stage called name, and the name of its cProfile dump,
+    if profile is True.  Where the peak RSS cannot be reset between stages,
+    it is saved as process_peak_rss_kb instead of peak_rss_kb, since it is
+    then the peak of the whole process so far.
+    """
+    per_stage = reset_peak_rss()
+    times = os.times()
+    wall = time.time()
+    result = {"stage": name}
+    if profile:
+        result["profile"] = "profile_%s.prof" % name
+        profiler = cProfile.Profile()
+        try:
+            profiler.runcall(func, args)
+        finally:
+            profiler.dump_stats(result["profile"])
+    else:
+        func(args)
+    result["wall"] = time.time() - wall
+    result["cpu"] = sum(os.times()[:4]) - sum(times[:4])
+    if per_stage:
+        result["peak_rss_kb"] = peak_rss()
+    else:
+        result["process_peak_rss_kb"] = peak_rss()
+    return result
+
+def write_report(filename, script, results, files):
+    """
+    Save the results of run_stage for the stages run, and the sizes of
+    the input files named in files (or of their compressed versions, see
+    inputs.find), to filename as JSON.
+    """
+    found = [(f, inputs.find(f)) for f in files]
+    report = {"script": os.path.abspath(script), "stages": results,
+            "inputs": dict((f, os.path.getsize(path)) for f, path in found
+                if os.path.exists(path)),
+            "python": platform.python_version(), "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+    fp = open(filename, "w")
+    json.dump(report, fp, indent=2, sort_keys=True)
+    fp.close()
+
+def main(stages, p, script, inputs=()):
+    """
+    Parse the command line with the parser p and run the stages chosen,
+    or all of them, in order.  Each stage function is called with the
+    parsed arguments.  Timings are saved to the report file even if a stage
+    fails.
+    """
+    args = p.parse_args()
+    if args.check_imports:
+        sys.exit(0 if check_imports(script) else 1)
+    names = [name for name, func, message in stages]
+    chosen = args.stages + args.only
+    unknown = [name for name in chosen + args.skip if name not in names]
+    if unknown:
+        p.error("unknown stage(s) %s, choose from %s" % (", ".join(unknown),
+            ", ".join(names)))
+    results = []
+    try:
+        for name, func, message in stages:
+            if (chosen and name not in chosen) or name in args.skip:
+                continue
+            print(message + "...")
+            try:
+                results.append(run_stage(name, func, args, args.profile))
+            except Exception:
+                results.append({"stage": name, "failed": True})
+                raise
+            result = results[-1]
+            if "peak_rss_kb" in result:
+                memory = "%d KB peak RSS" % result["peak_rss_kb"]
+            else:
+                memory = "%d KB peak RSS of the process so far" % \
+                        result["process_peak_rss_kb"]
+            print("%s: %.2fs wall, %.2fs CPU, %s" % (name, result["wall"],
+                result["cpu"], memory))
+    finally:
+        write_report(args.report, script, results, inputs)
@@ -0,0 +1,40 @@
+"""
+Tests of the filtering of encoded data matrices.  Run from examples/ with
+
+    python -m unittest test_matrix
+"""
+import unittest
+
+import matrix
+
+class FilterTest(unittest.TestCase):
+
+    def setUp(self):
+        # f1 varies everywhere, f2 only varies because of language c, f3 is
+        # constant and f4 has a single value with a synonym in language b
+        self.matrix = matrix.Matrix(["a", "b", "c"], ["f1", "f2", "f3", "f4"],
+                [[0, 0, 0, 0],
+                 [1, 0, 0, -1],
+                 [0, 1, 0, 0]],
+                [["x", "y"], ["x", "y"], ["x"], ["x", "y"]],
+                [(0, 3, 1)])
+
+    def test_drops_constant_features(self):
+        filtered = self.matrix.filter()
+        self.assertEqual(filtered.features, ["f1", "f2", "f4"])
+
+    def test_drops_features_constant_in_languages(self):
+        filtered = self.matrix.filter(["b", "a"])
+        self.assertEqual(filtered.languages, ["b", "a"])
+        self.assertEqual(filtered.features, ["f1", "f4"])
+        self.assertEqual(filtered.value("b", "f1"), "y")
+        self.assertEqual(filtered.states[1], ["x", "y"])
+
+    def test_minimum_data_and_states(self):
+        filtered = self.matrix.filter(["a", "b"], minimum_data=100)
+        self.assertEqual(filtered.features, ["f1"])
+        filtered = self.matrix.filter(["a", "b"], minimum_states=1)
+        self.assertEqual(filtered.features, ["f1", "f2", "f3", "f4"])
+
+if __name__ == "__main__":
+    unittest.main()
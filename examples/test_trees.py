@@ -0,0 +1,56 @@
+"""
+Tests of Newick and NEXUS reading and writing.  Run from examples/ with
+
+    python -m unittest test_trees
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+import trees
+
+class QuotingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.names = ["Old Irish", "Greek (Ancient)", "Tocharian:A",
+                "Latin,Classical", "Hittite", "O'Neill"]
+        self.newick = "((%s:1,%s:2)%s:0.5,(%s:1,%s:1):1.5,%s:3);" % tuple(
+                trees._quote(name) for name in self.names)
+
+    def test_quotes_names_with_punctuation(self):
+        self.assertEqual(trees._quote("Hittite"), "Hittite")
+        self.assertEqual(trees._quote("Old Irish"), "'Old Irish'")
+        self.assertEqual(trees._quote("O'Neill"), "'O''Neill'")
+
+    def test_parses_quoted_names(self):
+        tree = trees.parse_newick(self.newick)
+        self.assertEqual(tree.leaf_names(), ["Old Irish", "Greek (Ancient)",
+            "Latin,Classical", "Hittite", "O'Neill"])
+        self.assertEqual(tree.name(1), "Tocharian:A")
+        self.assertEqual(tree.length.tolist()[1:], [0.5, 1, 2, 1.5, 1, 1, 3])
+
+    def test_round_trip(self):
+        tree = trees.parse_newick(self.newick)
+        newick = tree.write_newick()
+        self.assertEqual(newick, self.newick)
+        again = trees.parse_newick(newick)
+        self.assertEqual(again.leaf_names(), tree.leaf_names())
+        self.assertEqual(again.parent.tolist(), tree.parent.tolist())
+
+    def test_nexus_round_trip(self):
+        tree = trees.parse_newick(self.newick)
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, "trees.nex")
+            trees.write_nexus([tree, tree], filename)
+            loaded = trees.load_trees(filename)
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual(len(loaded), 2)
+        # Translate tables only apply to leaves
+        for again in loaded:
+            self.assertEqual(again.leaf_names(), tree.leaf_names())
+
+if __name__ == "__main__":
+    unittest.main()
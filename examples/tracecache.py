@@ -0,0 +1,155 @@
+"""
+Columnar binary cache for BEAST trace logs.
+
+A log is converted once into a directory next to it (austronesian.log becomes
+austronesian.log.cache/) holding one NumPy .npy file per parameter and an
+index.json file listing the column names.  Columns are memory-mapped when
+they are loaded, so code which only needs, say, the featureClockRate columns
+never touches the others or the original text.  The cache records the size
+and modification time of the log it was built from and is rebuilt whenever
+these change.  A compressed log (see inputs) is decompressed only once, to
+build the cache.
+"""
+import json
+import numbers
+import os
+import shutil
+
+import numpy as np
+
+import inputs
+import traces
+
+CACHE_SUFFIX = ".cache"
+INDEX = "index.json"
+# Number of values to hold in memory at once when transposing rows to columns
+TRANSPOSE_BUFFER = 8*1024*1024
+
+def cache_dir(logfile):
+    """
+    Return the name of the cache directory for logfile.  This is the same
+    whether logfile is found as it is or compressed.
+    """
+    return logfile + CACHE_SUFFIX
+
+def _stamp(logfile):
+    st = os.stat(inputs.find(logfile))
+    return st.st_size, st.st_mtime
+
+def is_fresh(logfile, directory=None):
+    """
+    Return True if a cache exists for logfile and was built from the current
+    version of the file.
+    """
+    directory = directory or cache_dir(logfile)
+    try:
+        fp = open(os.path.join(directory, INDEX), "r")
+    except IOError:
+        return False
+    index = json.load(fp)
+    fp.close()
+    return (index["size"], index["mtime"]) == _stamp(logfile)
+
+def build(logfile, directory=None, blocksize=traces.BLOCKSIZE):
+    """
+    Convert logfile into a columnar cache in directory, replacing any cache
+    which is already there.  The log is streamed into a temporary row-major
+    file and then transposed a group of columns at a time, so memory use is
+    bounded regardless of the size of the log.
+    """
+    directory = directory or cache_dir(logfile)
+    size, mtime = _stamp(logfile)
+    if os.path.exists(directory):
+        shutil.rmtree(directory)
+    os.makedirs(directory)
+
+    names, blocks = traces.read_blocks(logfile, burnin=0, blocksize=blocksize)
+    tmp = os.path.join(directory, "rows.tmp")
+    fp = open(tmp, "wb")
+    N = 0
+    for block in blocks:
+        block.astype("<f8").tofile(fp)
+        N += len(block)
+    fp.close()
+
+    columns = []
+    M = len(names)
+    if N:
+        rows = np.memmap(tmp, dtype="<f8", mode="r", shape=(N, M))
+        width = max(1, TRANSPOSE_BUFFER // N)
+        for start in range(0, M, width):
+            group = np.array(rows[:, start:start+width])
+            for offset in range(group.shape[1]):
+                i = start + offset
+                # BEAST's Sample column holds integer state numbers
+                dtype = "<i8" if names[i] == "Sample" else "<f8"
+                filename = "%05d.npy" % i
+                np.save(os.path.join(directory, filename),
+                        group[:, offset].astype(dtype))
+                columns.append({"name": names[i], "file": filename,
+                    "dtype": dtype})
+        del rows
+    os.remove(tmp)
+
+    # Write the index last, so an interrupted build is never mistaken for a
+    # complete one
+    index = {"source": os.path.basename(logfile), "size": size,
+            "mtime": mtime, "rows": N, "columns": columns}
+    fp = open(os.path.join(directory, INDEX), "w")
+    json.dump(index, fp, indent=1)
+    fp.close()
+
+def load(logfile, directory=None):
+    """
+    Return a TraceCache for logfile, building or rebuilding the cache first
+    if it is missing or out of date.
+    """
+    directory = directory or cache_dir(logfile)
+    if not is_fresh(logfile, directory):
+        build(logfile, directory)
+    return TraceCache(directory)
+
+class TraceCache(object):
+    """
+    Lazy, column-by-column access to a cached BEAST log.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        fp = open(os.path.join(directory, INDEX), "r")
+        index = json.load(fp)
+        fp.close()
+        self.rows = index["rows"]
+        self.names = [c["name"] for c in index["columns"]]
+        self._files = dict((c["name"], c["file"]) for c in index["columns"])
+
+    def column(self, name):
+        """
+        Return a read-only memory-mapped array of every sample of the named
+        parameter, including burnin.
+        """
+        return np.load(os.path.join(self.directory, self._files[name]),
+                mmap_mode="r")
+
+    def select(self, columns=None):
+        """
+        Return the names of the columns selected by columns (see
+        traces.select_columns) and a list of their memory-mapped arrays.
+        """
+        names = [self.names[i] for i in traces.select_columns(self.names, columns)]
+        return names, [self.column(name) for name in names]
+
+    def summarise(self, columns=None, burnin=0.1, blocksize=traces.BLOCKSIZE,
+            summary=traces.RunningSummary):
+        """
+        Summarise the post-burnin samples of the selected columns, exactly as
+        traces.summarise would for the original log.
+        """
+        skip = burnin if isinstance(burnin, numbers.Integral) else int(burnin*self.rows)
+        names, arrays = self.select(columns)
+        summary = summary(names)
+        summary.skipped = min(skip, self.rows)
+        for start in range(skip, self.rows, blocksize):
+            block = np.column_stack([a[start:start+blocksize] for a in arrays])
+            summary.update(block.astype(float))
+        return summary
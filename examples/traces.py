@@ -0,0 +1,498 @@
+"""
+Streaming access to the tab-delimited trace logs written by BEAST.
+
+Logs are read exactly once, in blocks of rows which are converted to NumPy
+arrays, so that summary statistics can be accumulated one block at a time
+without ever holding the whole chain in memory.  Logs compressed with
+gzip, xz or bzip2 are read directly (see inputs).
+"""
+import numbers
+import os
+
+import numpy as np
+
+import inputs
+
+BLOCKSIZE = 1000
+RESERVOIR = 10000
+# Bins, and the range of values they cover, of HistogramSummary
+HISTOGRAM_BINS = 2000
+HISTOGRAM_RANGE = (1e-4, 1e4)
+
+def open_log(logfile):
+    """
+    Open a BEAST log file, or a compressed version of it, for reading.
+    """
+    return inputs.open_input(logfile, "r")
+
+def read_header(fp):
+    """
+    Skip over any leading comment lines in an open log file and return the
+    list of column names.  Unnamed columns (BEAST leaves a trailing tab on
+    every line) are returned as empty strings.
+    """
+    for line in fp:
+        if line.startswith("#") or not line.strip():
+            continue
+        return line.rstrip("\r\n").split("\t")
+    raise ValueError("No header found in BEAST log")
+
+def select_columns(names, columns=None):
+    """
+    Return the indices of the named columns in names which are selected by
+    columns, which may be None (select everything), a list of names or a
+    function which accepts a name and returns True or False.
+    """
+    if columns is None:
+        return [i for i, name in enumerate(names) if name]
+    if callable(columns):
+        return [i for i, name in enumerate(names) if name and columns(name)]
+    index = dict((name, i) for i, name in enumerate(names))
+    return [index[name] for name in columns]
+
+def _last_line(logfile):
+    """
+    Return the last non-empty line of logfile, reading backwards from the end
+    of the file rather than through it.  A compressed log has to be read
+    through to the end instead.
+    """
+    logfile = inputs.find(logfile)
+    if inputs.compression(logfile):
+        last = ""
+        fp = inputs.open_input(logfile, "r")
+        for line in fp:
+            if line.strip():
+                last = line
+        fp.close()
+        return last.strip()
+    fp = open(logfile, "rb")
+    fp.seek(0, 2)
+    end = fp.tell()
+    chunk = b""
+    pos = end
+    while pos > 0:
+        step = min(4096, pos)
+        pos -= step
+        fp.seek(pos)
+        chunk = fp.read(step) + chunk
+        lines = chunk.rstrip().split(b"\n")
+        if len(lines) > 1 or pos == 0:
+            fp.close()
+            return lines[-1].decode("utf8")
+    fp.close()
+    return ""
+
+def last_state(logfile):
+    """
+    Return the Sample value of the last row of logfile, or None if no
+    samples have been logged yet.  This is cheap enough to call repeatedly
+    on the log of a running chain to follow its progress.
+    """
+    if not os.path.exists(inputs.find(logfile)):
+        return None
+    try:
+        return int(float(_last_line(logfile).split("\t")[0]))
+    except ValueError:
+        return None
+
+def count_samples(logfile):
+    """
+    Return the number of samples in logfile.  BEAST logs states at a fixed
+    interval, so this can be computed from the Sample column of the first two
+    rows and the last row without reading the rest of the file (unless it is
+    compressed).  If the logging interval turns out to be irregular, the
+    rows are counted instead.
+    """
+    fp = open_log(logfile)
+    names = read_header(fp)
+    sample = names.index("Sample") if "Sample" in names else 0
+    states = []
+    for line in fp:
+        if line.strip():
+            states.append(int(float(line.split("\t")[sample])))
+        if len(states) == 2:
+            break
+    if len(states) < 2:
+        fp.close()
+        return len(states)
+    last = int(float(_last_line(logfile).split("\t")[sample]))
+    step = states[1] - states[0]
+    if step > 0 and (last - states[0]) % step == 0:
+        fp.close()
+        return (last - states[0]) // step + 1
+    # Irregular logging interval, so count the hard way
+    N = 2 + sum(1 for line in fp if line.strip())
+    fp.close()
+    return N
+
+def burnin_samples(logfile, burnin):
+    """
+    Convert a burnin specification into a number of samples.  An integer
+    burnin is taken to be a number of samples already, anything else is
+    taken to be the fraction of the chain to discard.
+    """
+    if isinstance(burnin, numbers.Integral):
+        return burnin
+    return int(burnin*count_samples(logfile))
+
+def read_blocks(logfile, columns=None, burnin=0.1, blocksize=BLOCKSIZE):
+    """
+    Read logfile in a single pass, discarding burnin samples.  Returns the
+    list of selected column names and a generator which yields the remaining
+    samples as 2D arrays of at most blocksize rows, with one column for each
+    selected name.
+    """
+    skip = burnin_samples(logfile, burnin)
+    fp = open_log(logfile)
+    header = read_header(fp)
+    indices = select_columns(header, columns)
+    names = [header[i] for i in indices]
+
+    def blocks():
+        lines = []
+        seen = 0
+        for line in fp:
+            if not line.strip():
+                continue
+            seen += 1
+            if seen <= skip:
+                continue
+            lines.append(line)
+            if len(lines) == blocksize:
+                yield parse_block(lines, indices)
+                lines = []
+        if lines:
+            yield parse_block(lines, indices)
+        fp.close()
+
+    return names, blocks()
+
+def parse_block(lines, indices):
+    """
+    Convert a list of tab-delimited log lines into a 2D array holding only
+    the columns at the given indices.
+    """
+    return np.loadtxt(lines, delimiter="\t", usecols=indices, ndmin=2)
+
+class RunningSummary(object):
+    """
+    Per-column sample size, mean, variance and quantiles which are updated
+    one block of samples at a time.  Means and variances are merged using
+    Chan et al.'s pairwise update, and quantiles are estimated from a
+    fixed-size uniform reservoir of samples, so memory use does not depend
+    upon the number of samples seen.  The reservoir is only kept if its
+    size is given (e.g. RESERVOIR), since most uses need only the means.
+    skipped is the number of burnin samples discarded before the first
+    update, as set by summarise.
+    """
+
+    def __init__(self, names, reservoir=None, seed=None):
+        self.names = list(names)
+        self.n = 0
+        self.skipped = 0
+        self.mean = np.zeros(len(self.names))
+        self._m2 = np.zeros(len(self.names))
+        self._reservoir = np.empty((reservoir or 0, len(self.names)))
+        self._filled = 0
+        self._random = np.random.RandomState(seed)
+
+    def update(self, block):
+        """
+        Incorporate a 2D array of samples into the summary.
+        """
+        k = len(block)
+        if not k:
+            return
+        block_mean = block.mean(axis=0)
+        block_m2 = ((block - block_mean)**2).sum(axis=0)
+        delta = block_mean - self.mean
+        total = self.n + k
+        self.mean += delta*k/total
+        self._m2 += block_m2 + delta**2*self.n*k/total
+        self._sample(block)
+        self.n = total
+
+    def _sample(self, block):
+        size = len(self._reservoir)
+        if not size:
+            return
+        free = min(size - self._filled, len(block))
+        if free:
+            self._reservoir[self._filled:self._filled+free] = block[:free]
+            self._filled += free
+        rest = block[free:]
+        if not len(rest):
+            return
+        # Row i (counting from zero over the whole chain) replaces a random
+        # reservoir slot with probability size/(i+1)
+        seen = self.n + free + np.arange(len(rest))
+        slots = (self._random.random_sample(len(rest))*(seen + 1)).astype(int)
+        keep = slots < size
+        self._reservoir[slots[keep]] = rest[keep]
+
+    @property
+    def variance(self):
+        """
+        The unbiased sample variance of each column.
+        """
+        if self.n < 2:
+            return np.zeros(len(self.names))
+        return self._m2/(self.n - 1)
+
+    def quantiles(self, q):
+        """
+        Estimate the q'th quantile (or quantiles, if q is a sequence) of
+        each column.
+        """
+        if not len(self._reservoir):
+            raise ValueError("Quantiles need a RunningSummary with a reservoir")
+        sample = self._reservoir[:self._filled]
+        return np.percentile(sample, np.asarray(q)*100, axis=0)
+
+class RankSummary(object):
+    """
+    Per-column distribution of ranks, from 1 for the smallest value to the
+    number of columns for the largest, when the columns are ranked within
+    every sample.  Each block of samples is ranked with a single argsort
+    and tallied into a column-by-rank matrix of counts with a single
+    bincount, so memory use depends only upon the number of columns.
+    """
+
+    def __init__(self, names):
+        self.names = list(names)
+        self.n = 0
+        self.skipped = 0
+        self.counts = np.zeros((len(self.names), len(self.names)), dtype=np.int64)
+
+    def update(self, block):
+        """
+        Incorporate a 2D array of samples into the summary.
+        """
+        if not len(block):
+            return
+        m = len(self.names)
+        ranks = np.empty(block.shape, dtype=np.int64)
+        order = np.argsort(block, axis=1)
+        ranks[np.arange(len(block))[:, None], order] = np.arange(m)
+        cells = (np.arange(m)*m + ranks).ravel()
+        self.counts += np.bincount(cells, minlength=m*m).reshape(m, m)
+        self.n += len(block)
+
+    @property
+    def mean(self):
+        """
+        The posterior mean rank of each column.
+        """
+        return self.counts.dot(np.arange(1, len(self.names) + 1))/float(self.n)
+
+    def quantiles(self, q):
+        """
+        Return the q'th quantile (or quantiles, if q is a sequence) of the
+        rank of each column.
+        """
+        cumulative = np.cumsum(self.counts, axis=1)/float(self.n)
+        q = np.asarray(q, dtype=float)
+        below = (cumulative[None, :, :] < q.reshape(-1, 1, 1)).sum(axis=2)
+        return (below + 1).reshape(q.shape + (len(self.names),))
+
+    def top(self, k):
+        """
+        Return the posterior probability of each column being among the k
+        smallest.
+        """
+        return self.counts[:, :k].sum(axis=1)/float(self.n)
+
+    def bottom(self, k):
+        """
+        Return the posterior probability of each column being among the k
+        largest.
+        """
+        return self.counts[:, len(self.names)-k:].sum(axis=1)/float(self.n)
+
+class HistogramSummary(object):
+    """
+    Per-column sample size, mean and histogram, from which quantiles (and
+    so credible intervals) and densities of the full posterior
+    distribution are estimated.  The bins are fixed in advance, evenly
+    spaced over the logarithm of the values between limits (or over the
+    values themselves, if log is False), with one more bin at each end for
+    values outside them, so memory use depends only upon the numbers of
+    columns and bins.  Each block of samples is tallied with a single
+    bincount, as in RankSummary.  With the default limits and bins, each
+    bin is a little under one percent wide, relative to its values.
+    """
+
+    def __init__(self, names, bins=HISTOGRAM_BINS, limits=HISTOGRAM_RANGE,
+            log=True):
+        self.names = list(names)
+        self.n = 0
+        self.skipped = 0
+        self.mean = np.zeros(len(self.names))
+        self.log = log
+        lower, upper = np.log(limits) if log else limits
+        self.edges = np.linspace(lower, upper, bins + 1)
+        self.counts = np.zeros((len(self.names), bins + 2), dtype=np.int64)
+
+    def update(self, block):
+        """
+        Incorporate a 2D array of samples into the summary.
+        """
+        k = len(block)
+        if not k:
+            return
+        # The same update of the means as RunningSummary's
+        delta = block.mean(axis=0) - self.mean
+        total = self.n + k
+        self.mean += delta*k/total
+        self.n = total
+        if self.log:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                block = np.log(block)
+        bins = len(self.edges) - 1
+        width = (self.edges[-1] - self.edges[0])/bins
+        index = np.floor((block - self.edges[0])/width)
+        index = np.clip(np.nan_to_num(index), -1, bins).astype(np.int64) + 1
+        cells = (np.arange(len(self.names))*(bins + 2) + index).ravel()
+        self.counts += np.bincount(cells,
+                minlength=self.counts.size).reshape(self.counts.shape)
+
+    def quantiles(self, q):
+        """
+        Estimate the q'th quantile (or quantiles, if q is a sequence) of
+        each column, interpolating within bins.  Quantiles falling outside
+        the range of the bins are given as its limits.
+        """
+        q = np.asarray(q, dtype=float)
+        target = q.reshape(-1, 1)*self.n
+        cumulative = np.cumsum(self.counts, axis=1)
+        columns = np.arange(len(self.names))
+        quantiles = np.empty((len(target), len(self.names)))
+        for i, t in enumerate(target):
+            # The bin of each column in which the quantile falls
+            index = (cumulative < t[:, None]).sum(axis=1)
+            index = np.minimum(index, self.counts.shape[1] - 1)
+            count = self.counts[columns, index]
+            before = cumulative[columns, index] - count
+            fraction = np.clip((t - before)/np.maximum(count, 1), 0, 1)
+            edge = np.clip(index - 1, 0, len(self.edges) - 1)
+            value = self.edges[edge] + fraction*(self.edges[1] - self.edges[0])
+            value[index == 0] = self.edges[0]
+            value[index == len(self.edges)] = self.edges[-1]
+            quantiles[i] = value
+        if self.log:
+            quantiles = np.exp(quantiles)
+        return quantiles.reshape(q.shape + (len(self.names),))
+
+    def density(self):
+        """
+        Return the edges of the bins (on the scale of the values) and the
+        fraction of each column's samples in each bin, leaving out the
+        samples outside the range of the bins.
+        """
+        edges = np.exp(self.edges) if self.log else self.edges
+        return edges, self.counts[:, 1:-1]/float(max(self.n, 1))
+
+class TraceFollower(object):
+    """
+    Incremental summary of a log which BEAST is still writing.  A byte
+    offset into the log is kept between calls to poll, so each update only
+    reads and parses the rows appended since the last one.  An integer
+    burnin is a number of samples, as usual, but a fractional burnin can
+    only be converted into samples if the final chainlength is given, since
+    it cannot be read from an unfinished log.  burnin may also be a function
+    which converts the number of samples in the finished chain into a
+    number of burnin samples.  If the chainlength is given, final_state is
+    the state of the last sample the finished chain will log (the last
+    multiple of the logging interval, which need not divide the
+    chainlength), once two samples have been read.
+    """
+
+    def __init__(self, logfile, columns=None, burnin=0, chainlength=None):
+        if not isinstance(burnin, numbers.Integral) and chainlength is None:
+            raise ValueError("A fractional burnin requires the chainlength")
+        self.logfile = logfile
+        self.columns = columns
+        self.burnin = burnin
+        self.chainlength = chainlength
+        self.offset = 0
+        self.rows = 0
+        self.last_state = None
+        self.final_state = None
+        self.summary = None
+        self._skip = burnin if isinstance(burnin, numbers.Integral) else None
+        self._pending = []
+        self._indices = None
+        self._sample = None
+
+    def poll(self):
+        """
+        Read and summarise any complete rows appended to the log since the
+        last call, returning the number of post-burnin rows added.  A log
+        which BEAST has not created yet has no rows.
+        """
+        if not os.path.exists(inputs.find(self.logfile)):
+            return 0
+        fp = inputs.open_input(self.logfile, "rb")
+        fp.seek(self.offset)
+        data = fp.read()
+        fp.close()
+        # Leave any partially written line for next time
+        end = data.rfind(b"\n") + 1
+        self.offset += end
+        lines = [l for l in data[:end].decode("utf8").splitlines()
+                if l.strip() and not l.startswith("#")]
+        if lines and self.summary is None:
+            header = lines.pop(0).split("\t")
+            self._indices = select_columns(header, self.columns)
+            self._sample = header.index("Sample") if "Sample" in header else 0
+            self.summary = RunningSummary([header[i] for i in self._indices])
+        lines = self._pending + lines
+        if self.final_state is None and self.chainlength is not None:
+            # The logging interval, and hence the number of samples in the
+            # finished chain and the state of the last one, is known once
+            # two samples have been logged
+            if len(lines) < 2:
+                self._pending = lines
+                return 0
+            first, second = [int(float(l.split("\t")[self._sample]))
+                    for l in lines[:2]]
+            N = (self.chainlength - first) // (second - first) + 1
+            self.final_state = first + (N - 1)*(second - first)
+            if self._skip is None:
+                self._skip = self.burnin(N) if callable(self.burnin) else \
+                        int(self.burnin*N)
+        self._pending = []
+        if not lines:
+            return 0
+        block = parse_block(lines, [self._sample] + self._indices)
+        self.last_state = int(block[-1, 0])
+        keep = self.rows + np.arange(len(block)) >= self._skip
+        self.rows += len(block)
+        block = block[keep, 1:]
+        self.summary.update(block)
+        self.summary.skipped = self.rows - self.summary.n
+        return len(block)
+
+    @property
+    def finished(self):
+        """
+        True once the last sample of the chain has been read.
+        """
+        return self.final_state is not None and \
+                self.last_state is not None and \
+                self.last_state >= self.final_state
+
+def summarise(logfile, columns=None, burnin=0.1, blocksize=BLOCKSIZE,
+        summary=RunningSummary):
+    """
+    Summarise the post-burnin samples of the selected columns of logfile in
+    a single streaming pass, returning a RunningSummary (or an instance of
+    whichever summary class is given, such as RankSummary).
+    """
+    skip = burnin_samples(logfile, burnin)
+    names, blocks = read_blocks(logfile, columns, skip, blocksize)
+    summary = summary(names)
+    summary.skipped = skip
+    for block in blocks:
+        summary.update(block)
+    return summary
@@ -0,0 +1,516 @@
+"""
+Compact, array-backed trees, with Newick and NEXUS reading and writing.
+
+A Tree stores its nodes in preorder, so that every node comes after its
+parent and before all of its descendants, as three flat arrays: the index of
+each node's parent, the length of the branch above it and an index into a
+TaxonTable of node names.  Names are therefore stored once however many
+trees use them, relabelling only touches the table, and bottom-up
+computations are a single backwards pass over the parent array.  BEAST-style
+[&...] annotations are kept as raw strings, only for the nodes which have
+them, and parsed on request.
+"""
+import numbers
+import re
+
+import numpy as np
+
+import inputs
+
+_TOKEN = re.compile(r"'(?:[^']|'')*'|\[[^\]]*\]|[(),;:]|[^\s(),;:\[']+")
+_TRANSLATE = re.compile(r"([^\s,;']+)\s+('(?:[^']|'')*'|[^\s,;']+)")
+# Characters which cannot appear in an unquoted Newick label
+_UNSAFE = re.compile(r"[\s()\[\],:;']")
+_ANNOTATION = re.compile(r"([^=,{}]+)=(\{[^}]*\}|[^,]*)")
+# ETE's formatting of supports and branch lengths, as used by phyltr
+FLOAT_FORMAT = "%0.6g"
+
+class TaxonTable(object):
+    """
+    A list of node names and the index of each, shared by many Trees.
+    """
+    __slots__ = ("names", "index")
+
+    def __init__(self, names=()):
+        self.names = []
+        self.index = {}
+        for name in names:
+            self.add(name)
+
+    def add(self, name):
+        """
+        Return the index of name, adding it to the table if necessary.
+        """
+        i = self.index.get(name)
+        if i is None:
+            i = self.index[name] = len(self.names)
+            self.names.append(name)
+        return i
+
+    def __len__(self):
+        return len(self.names)
+
+def _quote(name):
+    """
+    Return name as a Newick label, quoted if it contains whitespace or
+    punctuation with a meaning in Newick, with any quotes in it doubled.
+    """
+    if _UNSAFE.search(name):
+        return "'%s'" % name.replace("'", "''")
+    return name
+
+def _unquote(label):
+    """
+    Return the name in a Newick label, which may be quoted.
+    """
+    if len(label) > 1 and label[0] == label[-1] == "'":
+        return label[1:-1].replace("''", "'")
+    return label
+
+def _index_type(n):
+    return np.int16 if n < 2**15 else np.int32
+
+class Tree(object):
+    """
+    A rooted tree with nodes numbered in preorder from the root, 0.
+    parent[i] is the parent of node i (-1 for the root), length[i] the
+    length of the branch above it (nan if it has none) and label[i] the
+    index of its name in taxa (-1 if it has none).  annotations maps nodes
+    to their raw [&...] comments.
+    """
+    __slots__ = ("parent", "length", "label", "taxa", "annotations",
+            "_children")
+
+    def __init__(self, parent, length, label, taxa, annotations=None):
+        self.parent = np.asarray(parent, dtype=_index_type(len(parent)))
+        self.length = np.asarray(length, dtype=float)
+        self.label = np.asarray(label, dtype=_index_type(len(taxa) + 1))
+        self.taxa = taxa
+        self.annotations = annotations or {}
+        self._children = None
+
+    def __len__(self):
+        return len(self.parent)
+
+    def name(self, node):
+        """
+        Return the name of node, or None if it has none.
+        """
+        label = self.label[node]
+        return self.taxa.names[label] if label >= 0 else None
+
+    def is_leaf(self):
+        """
+        Return a boolean array which is True for the leaves.
+        """
+        return np.bincount(self.parent[1:], minlength=len(self)) == 0
+
+    def leaves(self):
+        """
+        Return the indices of the leaves, from left to right.
+        """
+        return np.flatnonzero(self.is_leaf())
+
+    def leaf_names(self):
+        """
+        Return the names of the leaves, from left to right.
+        """
+        names = self.taxa.names
+        return [names[l] if l >= 0 else None for l in
+                self.label[self.is_leaf()].tolist()]
+
+    def children(self, node):
+        """
+        Return an array of the children of node, from left to right.
+        """
+        if self._children is None:
+            # Children sorted by parent, keeping preorder within each parent
+            order = np.argsort(self.parent[1:], kind="mergesort") + 1
+            counts = np.bincount(self.parent[1:], minlength=len(self))
+            starts = np.concatenate(([0], np.cumsum(counts)))
+            self._children = (order, starts)
+        order, starts = self._children
+        return order[starts[node]:starts[node+1]]
+
+    def preorder(self):
+        """
+        Return the nodes in preorder, which is simply their numbering.
+        """
+        return np.arange(len(self))
+
+    def postorder(self):
+        """
+        Return the nodes in postorder, every node after all of its
+        descendants, with the children of each node from left to right.
+        """
+        order = []
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            order.append(node)
+            stack.extend(self.children(node).tolist())
+        return np.array(order[::-1], dtype=self.parent.dtype)
+
+    def depths(self):
+        """
+        Return the number of branches between each node and the root.
+        """
+        depth = [0]*len(self)
+        parent = self.parent.tolist()
+        for node in range(1, len(self)):
+            depth[node] = depth[parent[node]] + 1
+        return np.array(depth)
+
+    def heights(self):
+        """
+        Return the distance from the root to each node, treating missing
+        branch lengths as zero.
+        """
+        height = np.nan_to_num(self.length).tolist()
+        height[0] = 0.0
+        parent = self.parent.tolist()
+        for node in range(1, len(self)):
+            height[node] += height[parent[node]]
+        return np.array(height)
+
+    def annotation(self, node):
+        """
+        Return the [&...] annotation of node parsed into a dictionary of
+        strings, or an empty dictionary if it has none.
+        """
+        return parse_annotation(self.annotations.get(node, ""))
+
+    def relabel(self, names):
+        """
+        Return a copy of this tree with nodes renamed according to names,
+        which is either a dictionary (names not in it are kept) or a
+        function of the old name returning the new one, or None to remove
+        the name.  Only the table of distinct names is visited, not the
+        nodes.
+        """
+        if isinstance(names, dict):
+            table = names
+            names = lambda old: table.get(old, old)
+        taxa = TaxonTable()
+        mapping = np.empty(len(self.taxa) + 1, dtype=int)
+        mapping[-1] = -1
+        for i, old in enumerate(self.taxa.names):
+            new = names(old)
+            mapping[i] = -1 if new is None else taxa.add(new)
+        return Tree(self.parent, self.length, mapping[self.label], taxa,
+                dict(self.annotations))
+
+    def name_mask(self, names):
+        """
+        Return a boolean array which is True for the nodes whose names are
+        in the collection names.  Only the table of names is searched.
+        """
+        names = set(names)
+        return np.array([name in names for name in self.taxa.names] +
+                [False])[self.label]
+
+    def prune(self, keep=None, drop=None, relabel=None, internal_names=True):
+        """
+        Return a copy of this tree with only some of its leaves, plus their
+        ancestors.  The leaves kept are those for which the boolean array
+        keep is True, or whose names are in keep if it is any other
+        collection, or else those whose names are not in drop.  Leaves
+        without names are dropped either way.  If relabel is given, nodes
+        are first renamed according to it (see relabel), and keep and drop
+        refer to the new names.  Internal node names are removed unless
+        internal_names is True.
+
+        Internal nodes left with a single child are removed in the same
+        pass, their branch lengths being added to their child's (nearest
+        first), except above the new root, which gets no branch length.
+        """
+        tree = self if relabel is None else self.relabel(relabel)
+        return tree._prune(tree._keep(keep, drop), internal_names)
+
+    def _keep(self, keep, drop):
+        leaf = self.is_leaf() & (self.label >= 0)
+        if isinstance(keep, np.ndarray):
+            return keep & leaf
+        if keep is not None:
+            return self.name_mask(keep) & leaf
+        if drop is not None:
+            return ~self.name_mask(drop) & leaf
+        return leaf
+
+    def _prune(self, keep, internal_names=True, parent=None, length=None,
+            label=None):
+        n = len(self)
+        parent = self.parent.tolist() if parent is None else parent
+        length = self.length.tolist() if length is None else length
+        label = self.label.tolist() if label is None else label
+        # Count the kept leaves below, and kept children of, every node in
+        # a single backwards (children before parents) pass
+        below = keep.astype(int).tolist()
+        kids = [0]*n
+        for node in range(n - 1, 0, -1):
+            if below[node]:
+                below[parent[node]] += below[node]
+                kids[parent[node]] += 1
+        if not below[0]:
+            raise ValueError("Pruning would remove every leaf")
+        # Then a forwards pass copies the kept nodes, in preorder.  up[node]
+        # is the new index of the node that node's kept children attach to,
+        # and chain[node] the lengths of the removed single-child nodes in
+        # between, nearest first
+        up = [-1]*n
+        chain = [()]*n
+        new_index = [-1]*n
+        new_parent = []
+        new_length = []
+        new_label = []
+        for node in range(n):
+            if not below[node]:
+                continue
+            p = parent[node]
+            target = up[p] if p >= 0 else -1
+            skipped = chain[p] if p >= 0 else ()
+            if kids[node] == 1:
+                up[node] = target
+                if target >= 0:
+                    chain[node] = (length[node],) + skipped
+                continue
+            new_index[node] = up[node] = len(new_parent)
+            new_parent.append(target)
+            if target < 0:
+                new_length.append(length[node] if node == 0 else float("nan"))
+            elif skipped:
+                total = 0.0 if length[node] != length[node] else length[node]
+                for extra in skipped:
+                    if extra == extra:
+                        total += extra
+                new_length.append(total)
+            else:
+                new_length.append(length[node])
+            new_label.append(label[node] if internal_names or kids[node] == 0
+                    else -1)
+        annotations = dict((new_index[k], v) for k, v in
+                self.annotations.items() if new_index[k] >= 0)
+        return Tree(new_parent, new_length, new_label, self.taxa, annotations)
+
+    def write_newick(self, labels=None, annotations=False,
+            length_format=FLOAT_FORMAT):
+        """
+        Return a Newick string for this tree.  If labels is given, it should
+        map internal nodes to numeric labels (e.g. clade supports), which
+        are written instead of names for every internal node except the
+        root.  Annotations are written if annotations is True.  The root is
+        given no name or branch length.  Names are quoted where necessary,
+        so that parse_newick reads them back unchanged.
+        """
+        parent = self.parent.tolist()
+        label = self.label.tolist()
+        length = self.length.tolist()
+        names = [_quote(name) for name in self.taxa.names]
+        notes = self.annotations if annotations else {}
+
+        def suffix(node, leaf):
+            s = ""
+            if labels is not None and not leaf:
+                s = FLOAT_FORMAT % labels[node]
+            elif label[node] >= 0:
+                s = names[label[node]]
+            if node in notes:
+                s += notes[node]
+            if length[node] == length[node]:
+                s += ":" + length_format % length[node]
+            return s
+
+        out = []
+        n = len(parent)
+        for node in range(1, n):
+            p = parent[node]
+            if p == node - 1:
+                out.append("(")
+            else:
+                # The previous node was a leaf: close its ancestors up to
+                # this node's parent
+                a = parent[node - 1]
+                while a != p:
+                    out.append(")" + suffix(a, False))
+                    a = parent[a]
+                out.append(",")
+            if node == n - 1 or parent[node + 1] != node:
+                out.append(suffix(node, True))
+        if n > 1:
+            a = parent[n - 1]
+            while a > 0:
+                out.append(")" + suffix(a, False))
+                a = parent[a]
+            out.append(")")
+        elif label[0] >= 0:
+            out.append(names[label[0]])
+        return "".join(out) + ";"
+
+def prune_batch(tree, subsets, relabel=None, internal_names=True):
+    """
+    Prune one tree to each of many sets of leaf names to keep, e.g. for
+    several datasets covering different languages, returning a list of
+    Trees.  The tree is relabelled and converted to lists once, so each
+    subset only costs the two passes of the pruning itself.
+    """
+    tree = tree if relabel is None else tree.relabel(relabel)
+    parent = tree.parent.tolist()
+    length = tree.length.tolist()
+    label = tree.label.tolist()
+    leaf = tree.is_leaf() & (tree.label >= 0)
+    # Search the table of names once for all subsets
+    index = tree.taxa.index
+    pruned = []
+    for subset in subsets:
+        wanted = np.zeros(len(tree.taxa) + 1, dtype=bool)
+        wanted[[index[name] for name in subset if name in index]] = True
+        pruned.append(tree._prune(wanted[tree.label] & leaf, internal_names,
+            parent, length, label))
+    return pruned
+
+def parse_annotation(comment):
+    """
+    Parse a BEAST annotation such as [&rate=0.5,height_95%_HPD={1.2,3.4}]
+    into a dictionary of strings.
+    """
+    comment = comment.strip("[]")
+    if comment.startswith("&"):
+        comment = comment[1:]
+    return dict((key.strip(), value.strip()) for key, value in
+            _ANNOTATION.findall(comment))
+
+def parse_newick(string, translate=None, taxa=None):
+    """
+    Parse a Newick tree and return it as a Tree.  Names may be quoted, with
+    quotes in them doubled.  If translate is given, leaf names are replaced
+    according to it.  If taxa is given, it is the
+    TaxonTable to store names in, which may be shared with other trees.
+    """
+    taxa = TaxonTable() if taxa is None else taxa
+    parent = [-1]
+    length = [float("nan")]
+    label = [-1]
+    annotations = {}
+    node = 0
+    stack = []
+    is_length = False
+    internal = False
+    for token in _TOKEN.findall(string):
+        c = token[0]
+        if c == "(":
+            stack.append(node)
+            node = len(parent)
+            parent.append(stack[-1])
+            length.append(float("nan"))
+            label.append(-1)
+            internal = False
+        elif c == ",":
+            node = len(parent)
+            parent.append(stack[-1])
+            length.append(float("nan"))
+            label.append(-1)
+            internal = False
+        elif c == ")":
+            node = stack.pop()
+            internal = True
+        elif c == ":":
+            is_length = True
+        elif c == ";":
+            break
+        elif c == "[":
+            annotations[node] = annotations.get(node, "") + token
+        elif is_length:
+            length[node] = float(token)
+            is_length = False
+        else:
+            name = _unquote(token)
+            if translate and not internal:
+                name = translate.get(name, name)
+            label[node] = taxa.add(name)
+    return Tree(parent, length, label, taxa, annotations)
+
+def statements(filename, start=0, end=None, translate=None):
+    """
+    Iterate over the tree statements of a NEXUS (or plain Newick) file,
+    yielding (offset, name, newick string, translate table) tuples, where
+    offset is the byte offset of the statement in the file.  If start is
+    given it must be the offset of a tree statement, and the translate table
+    must then be supplied, since the NEXUS header is skipped.  Statements
+    starting at or after end (if it is not None) are not read.  Compressed
+    files are read as well (see inputs), with offsets into the decompressed
+    text.
+    """
+    fp = inputs.open_input(filename, "rb")
+    if start:
+        fp.seek(start)
+    offset = start
+    translate = {} if translate is None else translate
+    in_translate = False
+    pending = None
+    for raw in fp:
+        line = raw.decode("utf8").strip()
+        line_start = offset
+        offset += len(raw)
+        if pending is None and end is not None and line_start >= end:
+            break
+        if pending is not None:
+            pending[2] += line
+        elif in_translate:
+            for key, name in _TRANSLATE.findall(line):
+                translate[key] = _unquote(name)
+            in_translate = not line.endswith(";")
+            continue
+        elif line.lower() == "translate":
+            in_translate = True
+            continue
+        elif line.lower().startswith("tree "):
+            name, newick = line[5:].split("=", 1)
+            pending = [line_start, name.strip(), newick.strip()]
+        elif line.startswith("("):
+            pending = [line_start, None, line]
+        else:
+            continue
+        if pending[2].endswith(";"):
+            yield pending[0], pending[1], pending[2], translate
+            pending = None
+    fp.close()
+
+def read_trees(filename, burnin=0, taxa=None):
+    """
+    Iterate over the trees in the NEXUS or Newick file filename, discarding
+    burnin trees (an integer is a number of trees, anything else a fraction
+    of the sample), and yielding (offset, Tree) pairs, where offset is the
+    byte offset of the tree statement.  All the trees share one TaxonTable.
+    """
+    if not isinstance(burnin, numbers.Integral):
+        burnin = int(burnin*sum(1 for s in statements(filename)))
+    taxa = TaxonTable() if taxa is None else taxa
+    for i, (offset, name, newick, translate) in enumerate(statements(filename)):
+        if i >= burnin:
+            yield offset, parse_newick(newick, translate, taxa)
+
+def load_trees(filename, burnin=0):
+    """
+    Return a list of all the post-burnin trees in filename.
+    """
+    return [tree for offset, tree in read_trees(filename, burnin)]
+
+def write_nexus(trees, filename, annotations=True):
+    """
+    Save a list of Trees which share a TaxonTable to filename as a NEXUS
+    file, with a translate block for their leaf names.
+    """
+    taxa = trees[0].taxa if trees else TaxonTable()
+    numbered = TaxonTable(str(i + 1) for i in range(len(taxa)))
+    fp = open(filename, "w")
+    fp.write("#NEXUS\n\nBegin trees;\n\tTranslate\n")
+    fp.write(",\n".join("\t\t%d %s" % (i + 1, _quote(name))
+        for i, name in enumerate(taxa.names)))
+    fp.write("\n;\n")
+    for i, tree in enumerate(trees):
+        tree = Tree(tree.parent, tree.length, tree.label, numbered,
+                tree.annotations)
+        fp.write("tree TREE%d = %s\n" % (i + 1,
+            tree.write_newick(annotations=annotations)))
+    fp.write("End;\n")
+    fp.close()
@@ -0,0 +1,219 @@
+"""
+Streaming reader for posterior tree samples in NEXUS format, as written by
+BEAST.
+
+Trees are read one at a time, with burnin applied, and each parsed tree is
+handed to any number of consumers (see CladeCounter and MCCTree), so that a
+tree sample only has to be parsed once to find both clade credibilities and
+the maximum clade credibility tree, and is never held in memory in full.
+"""
+import multiprocessing
+import numbers
+
+import clades
+import trees
+
+def count_trees(filename):
+    """
+    Return the number of trees in filename, without parsing them.
+    """
+    return sum(1 for statement in trees.statements(filename))
+
+def tree_offsets(filename):
+    """
+    Return the translate table of filename and a list of the byte offsets
+    of all of its tree statements, without parsing any trees.
+    """
+    translate = {}
+    offsets = []
+    for offset, name, newick, translate in trees.statements(filename):
+        offsets.append(offset)
+    return translate, offsets
+
+def read_trees(filename, burnin=0.1):
+    """
+    Iterate over the trees in filename, discarding burnin trees.  An integer
+    burnin is a number of trees, anything else is a fraction of the sample.
+    Each tree is yielded as an (offset, trees.Tree) pair, where offset is the
+    byte offset of the tree in the file.
+    """
+    if not isinstance(burnin, numbers.Integral):
+        burnin = int(burnin*count_trees(filename))
+    return trees.read_trees(filename, burnin)
+
+def read_tree_at(filename, offset, translate=None):
+    """
+    Parse and return the single tree whose statement starts at the given
+    byte offset of filename.
+    """
+    if translate is None:
+        translate = tree_offsets(filename)[0] if offset else {}
+    for start, name, newick, translate in trees.statements(filename, offset,
+            translate=translate):
+        if start == offset:
+            return trees.parse_newick(newick, translate)
+        break
+    raise ValueError("No tree at offset %d of %s" % (offset, filename))
+
+def process(filename, consumers, burnin=0.1):
+    """
+    Read the tree sample in filename once, passing each post-burnin tree to
+    the consume method of every consumer in turn.
+    """
+    for offset, tree in read_trees(filename, burnin):
+        for consumer in consumers:
+            consumer.consume(offset, tree)
+
+class CladeCounter(object):
+    """
+    Tree consumer which counts how many trees each clade appears in, using
+    a clades.CladeIndex.
+    """
+
+    def __init__(self, index=None):
+        self.index = index or clades.CladeIndex()
+        self.last = None
+
+    def consume(self, offset, tree):
+        self.last = self.index.add_tree(tree)
+
+    def write(self, filename):
+        """
+        Save every clade and its support to filename.
+        """
+        write_clades(self.index, filename)
+
+class MCCTree(object):
+    """
+    Tree consumer which finds the maximum clade credibility tree, i.e. the
+    tree whose clades have the greatest product of supports, using the
+    clade counts of a CladeCounter which sees the same trees first.  Only
+    the topology and file offset of the last tree with each distinct
+    topology is retained, and the winning tree is re-read from the file at
+    the end.
+    """
+
+    def __init__(self, counter, filename):
+        self.counter = counter
+        self.filename = filename
+        self.topologies = {}
+
+    def consume(self, offset, tree):
+        self.topologies[frozenset(self.counter.last)] = offset
+
+    def best(self):
+        """
+        Return the offset of the maximum clade credibility tree.  Many trees
+        in a sample share the best topology, and like phyltr support --sort
+        we choose the last of them.
+        """
+        score = self.counter.index.score
+        return max((score(t), offset) for t, offset in self.topologies.items())[1]
+
+    def write(self, filename):
+        """
+        Save the maximum clade credibility tree, labelled with clade
+        supports, to filename.
+        """
+        write_mcc_tree(self.filename, self.counter.index, self.best(),
+                filename)
+
+def write_clades(index, filename):
+    """
+    Save every clade counted by a CladeIndex and its support to filename,
+    from best supported to worst supported, in the same format as phyltr
+    clades.
+    """
+    fp = open(filename, "w")
+    for support, names in index.ranked():
+        fp.write("%.4f, [%s]\n" % (support, ",".join(names)))
+    fp.close()
+
+def write_mcc_tree(treefile, index, offset, filename):
+    """
+    Save the tree at the given offset of treefile to filename, labelled with
+    the clade supports in a CladeIndex.
+    """
+    tree = read_tree_at(treefile, offset)
+    supports = [index.support(mask) for mask in index.node_masks(tree)]
+    fp = open(filename, "w")
+    fp.write(tree.write_newick(supports) + "\n")
+    fp.close()
+
+def _shards(offsets, end, n):
+    """
+    Split a list of tree offsets into at most n contiguous (start, end) byte
+    ranges holding roughly equal numbers of trees.  The last range ends at
+    end, which may be None for the end of the file.
+    """
+    size = max(1, -(-len(offsets) // n))
+    bounds = offsets[::size] + [end]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+def _count_shard(args):
+    filename, start, end, translate, taxa = args
+    index = clades.CladeIndex(taxa)
+    table = trees.TaxonTable()
+    for offset, name, newick, tr in trees.statements(filename, start, end,
+            translate):
+        index.add_tree(trees.parse_newick(newick, translate, table))
+    return index
+
+_shared_index = None
+
+def _share_index(index):
+    global _shared_index
+    _shared_index = index
+
+def _score_shard(args):
+    filename, start, end, translate = args
+    index = _shared_index
+    best = None
+    table = trees.TaxonTable()
+    for offset, name, newick, tr in trees.statements(filename, start, end,
+            translate):
+        score = index.score(index.clades(trees.parse_newick(newick, translate,
+            table)))
+        if best is None or (score, offset) > best:
+            best = (score, offset)
+    return best
+
+def parallel_summary(filename, burnin=0.1, processes=None):
+    """
+    Count clades and find the maximum clade credibility tree of the tree
+    sample in filename using a pool of processes.  The post-burnin trees are
+    split into byte ranges of the file.  Workers count the clades in their
+    shard, the counts are merged, and a second parallel pass scores every
+    tree against the merged counts.  Returns the merged CladeIndex and the
+    offset of the maximum clade credibility tree, which is the same tree
+    found by CladeCounter and MCCTree.  A worker reading a compressed sample
+    has to decompress (but not parse) everything before its shard.
+    """
+    translate, offsets = tree_offsets(filename)
+    if not isinstance(burnin, numbers.Integral):
+        burnin = int(burnin*len(offsets))
+    offsets = offsets[burnin:]
+    if not offsets:
+        raise ValueError("No trees left in %s after burnin" % filename)
+    # Seed every worker with the same taxon order, so no bit translation
+    # is needed when merging
+    taxa = clades.CladeIndex()
+    taxa.clades(read_tree_at(filename, offsets[0], translate))
+    processes = processes or multiprocessing.cpu_count()
+    shards = _shards(offsets, None, processes)
+
+    pool = multiprocessing.Pool(processes)
+    indices = pool.map(_count_shard,
+            [(filename, s, e, translate, taxa.taxa) for s, e in shards])
+    pool.close()
+    pool.join()
+    index = indices[0]
+    for other in indices[1:]:
+        index.merge(other)
+
+    pool = multiprocessing.Pool(processes, _share_index, (index,))
+    best = pool.map(_score_shard,
+            [(filename, s, e, translate) for s, e in shards])
+    pool.close()
+    pool.join()
+    return index, max(best)[1]
@@ -1,34 +1,177 @@
-import csv
-
-def write_means(logfile, outfile):
-    fp = open(logfile,"r")
-    reader = csv.DictReader(fp, delimiter="\t")
-    # Find number of samples
-    N = 0
-    for row in reader:
-        N += 1
-    # Rewind file
-    fp.seek(0)
-    # Skip over 10% burnin
-    for i in range(0, int(0.1*N)):
-        reader.next()
-    # Compute means from remaining 90%
-    means = {}
-    for field in reader.fieldnames:
-        if field:
-            means[field] = 0
-    for row in reader:
-        for key in row:
-            if key:
-                means[key] += float(row[key])
-    means = {key:means[key]/N for key in means}
+import errno
+import numbers
+import os
+import time
+
+import tracecache
+import traces
+
+def is_rate(name):
+    """
+    Return True if name is the name of a per-feature relative rate parameter
+    in a BEAST log.
+    """
+    return "featureClockRate:" in name
+
+def write_means(logfile, outfile, burnin=0.1, cache=False):
+    """
+    Compute the posterior mean of every featureClockRate parameter in
+    logfile, discarding burnin samples (a number of samples, or a fraction of
+    the chain), and save them to outfile ranked from slowest to fastest.
+    The log is read only once.  If cache is True, the means are computed from
+    a columnar binary cache of the log (see tracecache), which is built first
+    if necessary.  The burnin and means are those of published_burnin and
+    total_means.
+    """
+    summary = summarise_means(logfile, burnin, cache)
+    ranked = rank_means(summary.names, total_means(summary))
+    save_means(ranked, outfile)
+    return ranked
+
+def write_rank_uncertainty(logfile, outfile, burnin=0.1, k=10, cache=False):
+    """
+    Rank the featureClockRate parameters in logfile within every
+    post-burnin sample, from slowest to fastest, and save each parameter's
+    posterior mean rank, median rank and 95% credible interval for its rank,
+    and its probabilities of being among the k slowest and the k fastest, to
+    outfile, ordered by mean rank.  Returns the traces.RankSummary.
+    """
+    if cache:
+        summary = tracecache.load(logfile).summarise(is_rate, burnin,
+                summary=traces.RankSummary)
+    else:
+        summary = traces.summarise(logfile, columns=is_rate, burnin=burnin,
+                summary=traces.RankSummary)
+    lower, median, upper = summary.quantiles([0.025, 0.5, 0.975])
+    rows = zip(summary.mean, summary.names, median, lower, upper,
+            summary.top(k), summary.bottom(k))
+    fp = open(outfile, "w")
+    fp.write("parameter,mean_rank,median_rank,lower,upper,p_slowest_%d,"
+            "p_fastest_%d\n" % (k, k))
+    for mean, key, med, lo, hi, top, bottom in sorted(rows):
+        fp.write("%s,%.2f,%d,%d,%d,%.4f,%.4f\n" % (key, mean, med, lo, hi,
+            top, bottom))
     fp.close()
-    # Rank columns by mean values
-    ranked = [(means[key],key) for key in means if "featureClockRate:" in key]
+    return summary
+
+def is_running(pid):
+    """
+    Return True if a process with the given ID is running.
+    """
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+def follow_means(logfile, outfile, chainlength, burnin=0.1, interval=60,
+        timeout=None, pid=None):
+    """
+    Keep outfile up to date with the ranked posterior means of the
+    featureClockRate parameters in logfile while BEAST is still writing it,
+    rewriting it every interval seconds if new samples have arrived.  The
+    log need not exist yet.  Once the last sample of the chain is logged
+    (the last state up to chainlength at the logging interval), the result
+    is the same as that of write_means with the same burnin, which is
+    returned.  A RuntimeError is raised instead if nothing is added to the
+    log for timeout seconds (if given), or if the process pid (if given), e.g.
+    BEAST's, exits before the chain is finished.
+    """
+    follower = traces.TraceFollower(logfile, is_rate,
+            lambda samples: published_burnin(burnin, samples), chainlength)
+    ranked = []
+    last_change = time.time()
+    while True:
+        # Check the process before polling, so that the last samples it
+        # wrote are read before giving up on it
+        running = pid is None or is_running(pid)
+        offset = follower.offset
+        added = follower.poll()
+        # Any new rows, burnin included, show that the chain is alive
+        if follower.offset > offset:
+            last_change = time.time()
+        if added:
+            summary = follower.summary
+            ranked = rank_means(summary.names, total_means(summary))
+            save_means(ranked, outfile)
+            print("State %d of %d: %d post-burnin samples" % (
+                follower.last_state, chainlength, summary.n))
+        if follower.finished:
+            return ranked
+        if not running:
+            raise RuntimeError("Process %d exited at state %s of %d"
+                    % (pid, follower.last_state, chainlength))
+        if timeout is not None and time.time() - last_change > timeout:
+            raise RuntimeError("Nothing added to %s for %g seconds, at state "
+                    "%s of %d" % (logfile, timeout, follower.last_state,
+                        chainlength))
+        time.sleep(interval)
+
+def published_burnin(burnin, samples):
+    """
+    Convert a burnin specification into the number of samples discarded by
+    the original version of write_means, which computed the published
+    parameter_means.csv files and tables, for a chain of the given number
+    of samples.  An integer burnin is a number of samples, as usual.  A
+    fraction is one sample less than int(burnin*samples), since the original
+    script read the header of the log again as its first sample after
+    rewinding the file, and so kept the last burnin sample.
+    """
+    if isinstance(burnin, numbers.Integral):
+        return burnin
+    return max(int(burnin*samples) - 1, 0)
+
+def summarise_means(logfile, burnin=0.1, cache=False,
+        summary=traces.RunningSummary):
+    """
+    Summarise the featureClockRate parameters in logfile, or in its cache,
+    discarding burnin samples as published_burnin does, for total_means.
+    Returns a traces.RunningSummary, or an instance of summary.
+    """
+    if cache:
+        trace = tracecache.load(logfile)
+        return trace.summarise(is_rate, published_burnin(burnin, trace.rows),
+                summary=summary)
+    skip = published_burnin(burnin, traces.count_samples(logfile))
+    return traces.summarise(logfile, columns=is_rate, burnin=skip,
+            summary=summary)
+
+def total_means(summary):
+    """
+    Return the means of the post-burnin samples in a summary (see traces)
+    as the published parameter_means.csv files and tables were computed:
+    their sums divided by the number of samples in the whole chain,
+    including the summary.skipped burnin samples.
+    """
+    return summary.mean*summary.n/float(max(summary.n + summary.skipped, 1))
+
+def rank_means(names, means):
+    """
+    Return a list of (mean, name) pairs sorted from smallest to largest mean.
+    """
+    ranked = [(float(mean), key) for mean, key in zip(means, names)]
     ranked.sort()
-    # Save ranked means
+    return ranked
+
+def save_means(ranked, outfile):
+    """
+    Save a list of (mean, name) pairs to outfile in the format of
+    parameter_means.csv.
+    """
     fp = open(outfile, "w")
     for mean, key in ranked:
         fp.write("%s,%f\n" % (key, mean))
     fp.close()
+
+def read_means(infile):
+    """
+    Read a list of (mean, name) pairs saved by save_means, in the order they
+    were saved.
+    """
+    fp = open(infile, "r")
+    ranked = []
+    for line in fp:
+        key, mean = line.strip().rsplit(",", 1)
+        ranked.append((float(mean), key))
+    fp.close()
     return ranked